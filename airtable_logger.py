@@ -1,17 +1,19 @@
 import os
+import time
+import asyncio
+import logging
 import datetime
-from dotenv import load_dotenv
-from pyairtable import Api
-
-# Load environment variables
-load_dotenv()
+import threading
+from audit_spool import AuditSpool
+from metrics import AIRTABLE_LATENCY, observe
 
+# Settings come from the environment; bootstrap.py loads .env before importing this module
 AIRTABLE_API_KEY = os.getenv('AIRTABLE_API_KEY')
 AIRTABLE_BASE_ID = os.getenv('AIRTABLE_BASE_ID')
 AIRTABLE_TABLE_NAME = os.getenv('AIRTABLE_TABLE_NAME')
-ADMIN_USERNAMES = os.getenv('ADMIN_USERS', '').split(',')
+ADMIN_USERNAMES = frozenset(filter(None, os.getenv('ADMIN_USERS', '').split(',')))
 
-# Valid actions and machines (for validation)
+# Valid actions (for validation)
 VALID_ACTIONS = [
     'Start Cycle',
     'Set Free',
@@ -20,75 +22,251 @@ VALID_ACTIONS = [
     'Refresh Status'
 ]
 
-VALID_MACHINES = [
-    'Ground Floor Wash',
-    'Ground Floor Dry',
-    'Floor 1 Wash 1',
-    'Floor 1 Wash 2',
-    'Floor 1 Dry 1',
-    'Floor 1 Dry 2',
-    'None'
-]
+# 'None' marks actions without a machine
+NO_MACHINE = 'None'
+
+# Airtable labels of every loaded machine registry (see register_machine_labels)
+machine_labels = {NO_MACHINE}
+
+# Logging pipeline settings
+BATCH_SIZE = 10  # Airtable accepts at most 10 records per request
+MAX_RETRIES = 5
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+OUTAGE_RETRY_DELAY = 60  # Seconds to wait after retries are exhausted
+FLUSH_TIMEOUT = 30  # Seconds to wait for pending records on shutdown
+AIRTABLE_POOL_SIZE = int(os.getenv('AIRTABLE_POOL_SIZE', '4'))  # Kept-alive connections to Airtable
+AIRTABLE_CONNECT_TIMEOUT = int(os.getenv('AIRTABLE_CONNECT_TIMEOUT', '5'))  # Seconds
+AIRTABLE_READ_TIMEOUT = int(os.getenv('AIRTABLE_READ_TIMEOUT', '30'))  # Seconds
+
+# Created on first delivery by get_api; pyairtable is slow to import
+api = None
+api_lock = threading.Lock()
+tables = {}
+
+# Every record is written to the spool before it is sent
+spool = AuditSpool()
+
+logger = logging.getLogger(__name__)
+
+# Created by start_logging_worker once the event loop is running
+spool_ready = None
+log_worker = None
+
+def register_machine_labels(labels):
+    """Accept the given machine labels in log_action."""
+    machine_labels.update(labels)
 
-api = Api(AIRTABLE_API_KEY)
-table = api.table(AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME)
+def get_api():
+    """Return the shared Airtable client, creating it on first use; safe to call from worker threads."""
+    global api
+    with api_lock:
+        if api is None:
+            from pyairtable import Api
+            from requests.adapters import HTTPAdapter
+            # Retries are handled by the logging worker, not by pyairtable; without a
+            # timeout a hung connection would hold a worker thread indefinitely
+            client = Api(
+                AIRTABLE_API_KEY,
+                timeout=(AIRTABLE_CONNECT_TIMEOUT, AIRTABLE_READ_TIMEOUT),
+                retry_strategy=None
+            )
+            # One session for every table, reusing its connections between batches
+            client.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=AIRTABLE_POOL_SIZE))
+            api = client
+        return api
 
-def log_action(username: str, action: str, machine: str, duration: int = None):
+def get_table(table_name=None):
+    """Return the Airtable table for `table_name` (default AIRTABLE_TABLE_NAME)."""
+    table_name = table_name or AIRTABLE_TABLE_NAME
+    table = tables.get(table_name)
+    if table is None:
+        table = tables[table_name] = get_api().table(AIRTABLE_BASE_ID, table_name)
+    return table
+
+def create_batch(table_name, records):
+    """Create records in one request; runs in a worker thread, so the client is built off the event loop."""
+    return get_table(table_name).batch_create(records)
+
+def log_action(username: str, action: str, machine: str, duration: int = None, table_name: str = None,
+               is_admin: bool = None, timestamp: datetime.datetime = None):
     """
-    Log an action to Airtable
+    Record an action and queue it for Airtable.
+
+    The record is appended to the local spool and the call returns; the
+    background worker delivers spooled records in order. Without a running
+    worker (e.g. the test block below) the record is sent synchronously.
     
     Parameters:
-    - username: Used only to check admin status
+    - username: Used only to check admin status when is_admin is not given
     - action: Must be one of VALID_ACTIONS
-    - machine: Must be one of VALID_MACHINES
+    - machine: A registered machine label, or NO_MACHINE
     - duration: Integer value for cycle duration (optional)
+    - table_name: Airtable table to log to (optional, defaults to AIRTABLE_TABLE_NAME)
+    - is_admin: Role from the tenant's authorization service (optional)
+    - timestamp: When the action happened (optional, defaults to now; set when replaying the event log)
     """
     try:
         # Validate action and machine
         if action not in VALID_ACTIONS:
             raise ValueError(f"Invalid action: {action}. Must be one of {VALID_ACTIONS}")
-        if machine not in VALID_MACHINES:
-            raise ValueError(f"Invalid machine: {machine}. Must be one of {VALID_MACHINES}")
+        if machine not in machine_labels:
+            raise ValueError(f"Invalid machine: {machine}. Must be a registered machine label")
 
         record = {
-            "Timestamp": datetime.datetime.now().isoformat(),
-            "IsAdmin": username in ADMIN_USERNAMES,
+            "Timestamp": (timestamp or datetime.datetime.now()).isoformat(),
+            "IsAdmin": is_admin if is_admin is not None else username in ADMIN_USERNAMES,
             "Action": str(action),
             "Machine": str(machine),
             "Duration": duration if duration is not None else 0
         }
         
-        # Print the record being sent for debugging
-        print(f"Sending record to Airtable: {record}")
-        
-        table.create(record)
-        print(f"Successfully logged action: {action} on {machine}")
-        
+        record_id = spool.append(record, table_name)
+        # Logged in the caller's correlation context; delivery logs refer back to this ID
+        logger.info("Queued audit record %s: %s on %s", record_id, action, machine)
+
+        if log_worker is None:
+            started = time.perf_counter()
+            get_table(table_name).create(record)
+            observe(AIRTABLE_LATENCY, started, 'create', 'ok')
+            spool.ack([record_id])
+            logger.info("Delivered audit record %s", record_id)
+            return
+
+        spool_ready.set()
+
     except Exception as e:
-        print(f"Failed to log to Airtable: {e}")
+        logger.error("Failed to log to Airtable: %s", e)
+
+def retry_delay(error, attempt):
+    """Return the backoff delay in seconds for a failed request."""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+    return 2 ** attempt
+
+async def write_batch(table_name, records):
+    """
+    Write up to BATCH_SIZE records, retrying with backoff on 429/5xx.
+
+    Returns True once written and False if Airtable rejects the records.
+    Raises the last error if every retry fails.
+    """
+    import requests
+    for attempt in range(MAX_RETRIES):
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(create_batch, table_name, records)
+            observe(AIRTABLE_LATENCY, started, 'batch_create', 'ok')
+            return True
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status not in RETRYABLE_STATUS_CODES:
+                observe(AIRTABLE_LATENCY, started, 'batch_create', 'rejected')
+                logger.error("Airtable rejected %s record(s): %s", len(records), e)
+                return False
+            error = e
+        except requests.exceptions.RequestException as e:
+            # Connection errors and timeouts are worth retrying too
+            error = e
+        observe(AIRTABLE_LATENCY, started, 'batch_create', 'retry')
+
+        if attempt < MAX_RETRIES - 1:
+            delay = retry_delay(error, attempt)
+            logger.warning("Airtable request failed (%s), retrying in %ss", error, delay)
+            await asyncio.sleep(delay)
+
+    raise error
+
+async def replay_spool():
+    """Background worker: send spooled records to Airtable in order."""
+    while True:
+        spool_ready.clear()
+        batch = await asyncio.to_thread(spool.pending, BATCH_SIZE)
+        if not batch:
+            await spool_ready.wait()
+            continue
+
+        # A batch goes to one table: take the oldest records bound for the same one
+        table_name = batch[0][1]
+        for index, (_, name, _) in enumerate(batch):
+            if name != table_name:
+                batch = batch[:index]
+                break
+
+        ids = [record_id for record_id, _, _ in batch]
+        try:
+            if await write_batch(table_name, [record for _, _, record in batch]):
+                await asyncio.to_thread(spool.ack, ids)
+                logger.info("Delivered audit records %s", ids)
+            else:
+                await asyncio.to_thread(spool.reject, ids)
+                logger.error("Rejected audit records %s", ids)
+        except Exception as e:
+            # Leave the records spooled and try again later, keeping their order
+            logger.error("Failed to log to Airtable, %s record(s) spooled: %s", spool.pending_count(), e)
+            await asyncio.sleep(OUTAGE_RETRY_DELAY)
+
+async def start_logging_worker(application=None):
+    """Start the background worker, replaying anything left from a previous run."""
+    global spool_ready, log_worker
+    if log_worker is not None:
+        # Already started by another Application in this process
+        return
+    spool_ready = asyncio.Event()
+    log_worker = asyncio.create_task(replay_spool())
+
+async def stop_logging_worker(application=None):
+    """Flush pending records and stop the background worker."""
+    global spool_ready, log_worker
+    if log_worker is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + FLUSH_TIMEOUT
+    while spool.pending_count() and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+
+    log_worker.cancel()
+    try:
+        await log_worker
+    except asyncio.CancelledError:
+        pass
+    spool_ready = None
+    log_worker = None
+
+    remaining = spool.pending_count()
+    if remaining:
+        logger.warning("%s record(s) left in the spool, they will be sent on next start", remaining)
 
 if __name__ == "__main__":
-    # Test different scenarios
+    # Test different scenarios; reads AIRTABLE_* from the environment, e.g. `env $(cat .env) python airtable_logger.py`
+    from logging_setup import setup_logging
+    setup_logging(log_format='text')
     print("Testing Airtable Logger...")
+    from machine_registry import get_registry
+    register_machine_labels(machine.label for machine in get_registry())
     
     # Test viewing status (admin)
     print("\nTesting with admin:")
     log_action(
-        username=ADMIN_USERNAMES[0],
+        username="admin_user",
         action="Start Cycle",
         machine="Ground Floor Wash",
-        duration=45
+        duration=45,
+        is_admin=True
     )
     
     # Test different actions
     print("\nTesting different actions:")
     test_actions = [
-        (ADMIN_USERNAMES[0], "Set Broken", "Floor 1 Dry 1", None),
-        ("regular_user", "Start Cycle", "Floor 1 Wash 2", 60),
-        (ADMIN_USERNAMES[0], "Set Free", "Ground Floor Dry", None)
+        ("admin_user", "Set Broken", "Floor 1 Dry 1", None, True),
+        ("regular_user", "Start Cycle", "Floor 1 Wash 2", 60, False),
+        ("admin_user", "Set Free", "Ground Floor Dry", None, True)
     ]
     
-    for username, action, machine, duration in test_actions:
-        log_action(username, action, machine, duration)
+    for username, action, machine, duration, is_admin in test_actions:
+        log_action(username, action, machine, duration, is_admin=is_admin)
     
     print("\nTest complete!") 
@@ -0,0 +1,361 @@
+"""
+Local usage analytics over the action log.
+
+Every logged action is also appended to per-tenant columns (timestamp,
+action, machine, duration, user) held in compact typed arrays and saved as
+a compressed NumPy archive. Statistics are computed with vectorized
+aggregation over the whole window, so a year of events takes milliseconds.
+NumPy is imported on first use, off the startup path.
+"""
+import os
+import time
+import array
+import asyncio
+import datetime
+import logging
+
+ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', 'analytics')
+ANALYTICS_SAVE_INTERVAL = int(os.getenv('ANALYTICS_SAVE_INTERVAL', '300'))  # Seconds between saves
+DEFAULT_WINDOW_DAYS = 30
+SAVE_KEY = ('analytics', 'save')
+
+# Action codes, in the order of airtable_logger.VALID_ACTIONS
+ACTIONS = ('Start Cycle', 'Set Free', 'Set Broken', 'Set Cycle', 'Refresh Status')
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+START_CYCLE, SET_FREE, SET_BROKEN, SET_CYCLE, REFRESH_STATUS = range(len(ACTIONS))
+NO_MACHINE_INDEX = -1
+
+EPOCH = datetime.datetime(1970, 1, 1)
+HEAT_LEVELS = ' ░▒▓█'
+
+logger = logging.getLogger(__name__)
+
+def wall_seconds(when=None):
+    """Local wall-clock time as seconds since 1970-01-01, so hours and weekdays are plain arithmetic."""
+    return ((when or datetime.datetime.now()) - EPOCH).total_seconds()
+
+class UsageAnalytics:
+    """Columnar event store and aggregations for one tenant."""
+
+    def __init__(self, tenant_id, registry, directory=ANALYTICS_DIR):
+        self.tenant_id = tenant_id
+        self.registry = registry
+        self.machines = [machine.id for machine in registry]
+        self.machine_index = registry.position_by_label
+        self.path = os.path.join(directory, f"{tenant_id}.npz")
+        self.scheduler = None
+        # Appends go to typed arrays; aggregations read NumPy copies of them
+        self.timestamps = array.array('d')
+        self.actions = array.array('b')
+        self.machine_ids = array.array('h')
+        self.durations = array.array('h')
+        self.user_ids = array.array('q')
+        self.saved_count = 0
+        self.frozen = None
+        self.loaded = False  # Whether the saved archive has been merged in
+        self.loading = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def record(self, action, machine_label, duration=None, user_id=None, when=None):
+        """Append one action to the columns."""
+        self.timestamps.append(wall_seconds(when))
+        self.actions.append(ACTION_CODES[action])
+        self.machine_ids.append(self.machine_index.get(machine_label, NO_MACHINE_INDEX))
+        self.durations.append(duration or 0)
+        self.user_ids.append(user_id or 0)
+
+    def truncate(self, since):
+        """
+        Drop the events recorded at or after `since` (a datetime), before
+        replaying them from the event log; earlier events, including those
+        only in the saved archive, are kept.
+        """
+        if not self.loaded:
+            self.load()
+        cutoff = wall_seconds(since)
+        keep = [i for i, timestamp in enumerate(self.timestamps) if timestamp < cutoff]
+        for name in ('timestamps', 'actions', 'machine_ids', 'durations', 'user_ids'):
+            column = getattr(self, name)
+            setattr(self, name, array.array(column.typecode, (column[i] for i in keep)))
+        self.saved_count = -1  # Save even if the rebuilt columns happen to have the same length
+        self.frozen = None
+
+    def columns(self):
+        """Return the columns as NumPy arrays, reusing the last copy if nothing was added."""
+        import numpy as np
+        if self.frozen is None or len(self.frozen['timestamp']) != len(self):
+            self.frozen = {
+                'timestamp': np.array(self.timestamps, dtype=np.float64),
+                'action': np.array(self.actions, dtype=np.int8),
+                'machine': np.array(self.machine_ids, dtype=np.int16),
+                'duration': np.array(self.durations, dtype=np.int16),
+                'user': np.array(self.user_ids, dtype=np.int64),
+            }
+        return self.frozen
+
+    def read(self):
+        """Return the saved columns as typed arrays, or None; machines are remapped by label in case the registry changed."""
+        if not os.path.exists(self.path):
+            return None
+        import numpy as np
+        with np.load(self.path) as data:
+            labels = list(data['labels'])
+            # Index -1 (no machine) maps to the appended last entry
+            remap = np.array([self.machine_index.get(label, NO_MACHINE_INDEX) for label in labels] + [NO_MACHINE_INDEX], dtype=np.int16)
+            machine = data['machine']
+            return {
+                'timestamps': array.array('d', data['timestamp'].tobytes()),
+                'actions': array.array('b', data['action'].astype(np.int8).tobytes()),
+                'machine_ids': array.array('h', remap[machine].tobytes()),
+                'durations': array.array('h', data['duration'].astype(np.int16).tobytes()),
+                'user_ids': array.array('q', data['user'].astype(np.int64).tobytes()),
+            }
+
+    def merge(self, saved):
+        """Put saved columns before the events recorded since startup."""
+        self.loaded = True
+        if saved is None:
+            return
+        for name, column in saved.items():
+            setattr(self, name, column + getattr(self, name))
+        self.saved_count = len(saved['timestamps'])
+        self.frozen = None
+        logger.info("Loaded %s analytics events for %s.", self.saved_count, self.tenant_id)
+
+    def load(self):
+        self.merge(self.read())
+
+    async def load_in_background(self):
+        """Read the saved archive in a thread, then start saving periodically."""
+        try:
+            saved = await asyncio.to_thread(self.read)
+        except Exception as e:
+            # Saving now would overwrite the unreadable archive
+            logger.error("Failed to load analytics for %s: %s", self.tenant_id, e)
+            return
+        if not self.loaded:
+            self.merge(saved)
+        self.scheduler.schedule(SAVE_KEY, ANALYTICS_SAVE_INTERVAL, self.save_periodically)
+
+    def save(self, columns=None):
+        """Write the columns to a compressed archive, atomically replacing the old one."""
+        import numpy as np
+        columns = columns or self.columns()
+        if len(columns['timestamp']) == self.saved_count:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f"{self.path}.tmp.npz"
+        np.savez_compressed(
+            temp_path,
+            labels=np.array([machine.label for machine in self.registry]),
+            **columns
+        )
+        os.replace(temp_path, self.path)
+        self.saved_count = len(columns['timestamp'])
+
+    async def save_periodically(self):
+        try:
+            # Copy on the event loop; appends cannot resize an array while it is being read
+            await asyncio.to_thread(self.save, self.columns())
+        except Exception as e:
+            logger.error("Failed to save analytics for %s: %s", self.tenant_id, e)
+        self.scheduler.schedule(SAVE_KEY, ANALYTICS_SAVE_INTERVAL, self.save_periodically)
+
+    def start(self, scheduler):
+        """Load saved events without delaying startup and save new ones every ANALYTICS_SAVE_INTERVAL on `scheduler`."""
+        self.scheduler = scheduler
+        self.loading = asyncio.create_task(self.load_in_background())
+
+    def stop(self):
+        if self.loading is not None:
+            self.loading.cancel()
+        if self.scheduler is not None:
+            self.scheduler.cancel(SAVE_KEY)
+        try:
+            if not self.loaded:
+                self.load()
+        except Exception as e:
+            logger.error("Not saving analytics for %s, the saved archive is unreadable: %s", self.tenant_id, e)
+            return
+        self.save()
+
+    def intervals(self, columns, now):
+        """
+        Return occupied and broken intervals as (machine, start, end) arrays.
+
+        Events are sorted per machine; each one lasts until the next event on
+        the same machine. A cycle additionally ends after its duration.
+        """
+        import numpy as np
+        has_machine = columns['machine'] >= 0
+        machine = columns['machine'][has_machine]
+        timestamp = columns['timestamp'][has_machine]
+        action = columns['action'][has_machine]
+        duration = columns['duration'][has_machine]
+        if not len(machine):
+            # Nothing recorded against a machine yet, e.g. a fresh deployment
+            empty = (machine, timestamp, timestamp)
+            return empty, empty
+
+        order = np.lexsort((timestamp, machine))
+        machine, timestamp, action, duration = machine[order], timestamp[order], action[order], duration[order]
+
+        next_event = np.empty_like(timestamp)
+        next_event[:-1] = timestamp[1:]
+        next_event[-1:] = now
+        last_of_machine = np.append(machine[1:] != machine[:-1], True)
+        next_event[last_of_machine] = now
+
+        cycle = (action == START_CYCLE) | (action == SET_CYCLE)
+        cycle_end = np.minimum(np.minimum(timestamp + duration * 60.0, next_event), now)
+        broken = action == SET_BROKEN
+        broken_end = np.minimum(next_event, now)
+        return (
+            (machine[cycle], timestamp[cycle], cycle_end[cycle]),
+            (machine[broken], timestamp[broken], broken_end[broken]),
+        )
+
+    def all_busy_wait(self, machine_ids, spans, since):
+        """
+        Average wait for a machine of a type when every one of them is busy.
+
+        Sweeps the busy spans of all machines of the type; while the busy
+        count equals the number of machines, a user arriving waits on
+        average half of the remaining all-busy stretch.
+        """
+        import numpy as np
+        machine, start, end = spans
+        selected = np.isin(machine, machine_ids)
+        start, end = np.maximum(start[selected], since), end[selected]
+        keep = end > start
+        start, end = start[keep], end[keep]
+        if not len(start):
+            return 0.0, 0.0
+
+        times = np.concatenate((start, end))
+        steps = np.concatenate((np.ones(len(start)), -np.ones(len(end))))
+        order = np.argsort(times, kind='stable')
+        times, busy = times[order], np.cumsum(steps[order])
+        lengths = np.diff(times)
+        full = busy[:-1] >= len(machine_ids)
+        full_lengths = lengths[full]
+        total = full_lengths.sum()
+        if total <= 0:
+            return 0.0, 0.0
+        return float((full_lengths ** 2).sum() / (2 * total)), float(total)
+
+    def stats(self, days=DEFAULT_WINDOW_DAYS, now=None):
+        """Compute usage statistics for the last `days` days."""
+        import numpy as np
+        now = wall_seconds() if now is None else now
+        since = now - days * 86400
+        columns = self.columns()
+        machine_count = len(self.machines)
+
+        (cycle_machine, cycle_start, cycle_end), (broken_machine, broken_start, broken_end) = self.intervals(columns, now)
+        cycle_start_clipped = np.maximum(cycle_start, since)
+        broken_start_clipped = np.maximum(broken_start, since)
+        occupied = np.bincount(
+            cycle_machine, weights=np.clip(cycle_end - cycle_start_clipped, 0, None), minlength=machine_count
+        )
+        broken = np.bincount(
+            broken_machine, weights=np.clip(broken_end - broken_start_clipped, 0, None), minlength=machine_count
+        )
+        window = now - since
+
+        in_window = columns['timestamp'] >= since
+        starts = in_window & (columns['action'] == START_CYCLE)
+        start_times = columns['timestamp'][starts]
+        hours = (start_times // 3600 % 24).astype(np.int64)
+        weekdays = ((start_times // 86400 + 3) % 7).astype(np.int64)  # 1970-01-01 was a Thursday
+        heatmap = np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+
+        busy_machine = np.concatenate((cycle_machine, broken_machine))
+        busy_spans = (
+            busy_machine,
+            np.concatenate((cycle_start, broken_start)),
+            np.concatenate((cycle_end, broken_end)),
+        )
+        waits = {}
+        for machine_type in sorted({machine.type for machine in self.registry}):
+            machine_ids = [i for i, machine in enumerate(self.registry) if machine.type == machine_type]
+            waits[machine_type] = self.all_busy_wait(machine_ids, busy_spans, since)
+
+        return {
+            'days': days,
+            'events': int(in_window.sum()),
+            'cycles': int(starts.sum()),
+            'utilization': {self.machines[i]: float(occupied[i] / window) for i in range(machine_count)},
+            'broken_hours': {self.machines[i]: float(broken[i] / 3600) for i in range(machine_count)},
+            'heatmap': heatmap,
+            'wait': waits,
+        }
+
+def format_stats(stats, registry):
+    """Render statistics as an HTML message."""
+    import numpy as np
+    lines = [f"📈 <b>Usage, last {stats['days']} days</b>", f"{stats['cycles']} cycles, {stats['events']} events", ""]
+
+    lines.append("<b>Utilization</b>")
+    for machine in registry:
+        utilization = stats['utilization'][machine.id]
+        broken_hours = stats['broken_hours'][machine.id]
+        broken_text = f", broken {broken_hours:.1f} h" if broken_hours else ""
+        lines.append(f"{machine.name}: {utilization:.0%}{broken_text}")
+
+    lines.append("")
+    lines.append("<b>Average wait when all are busy</b>")
+    for machine_type, (wait, busy) in stats['wait'].items():
+        lines.append(f"{machine_type.title()}s: {wait / 60:.0f} min (all busy {busy / 3600:.1f} h)")
+
+    heatmap = stats['heatmap']
+    peak = heatmap.max()
+    if peak:
+        levels = np.ceil(heatmap / peak * (len(HEAT_LEVELS) - 1)).astype(int)
+        rows = [
+            f"{day} {''.join(HEAT_LEVELS[level] for level in levels[i])}"
+            for i, day in enumerate(('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'))
+        ]
+        busiest = np.argsort(heatmap.sum(axis=0))[::-1][:3]
+        lines.append("")
+        lines.append("<b>Cycle starts by hour</b>")
+        lines.append("<pre>    0     6     12    18\n" + "\n".join(rows) + "</pre>")
+        lines.append("Busiest hours: " + ", ".join(f"{hour:02d}:00" for hour in busiest))
+
+    return "\n".join(lines)
+
+def benchmark(days=365, events_per_day=300):
+    """Time the /stats aggregation over `days` of synthetic events."""
+    import numpy as np
+    from machine_registry import get_registry
+    registry = get_registry()
+    analytics = UsageAnalytics('benchmark', registry, directory='.')
+    # A fresh deployment, and one that only saw status refreshes, must report zeros
+    assert analytics.stats()['cycles'] == 0
+    analytics.record('Refresh Status', 'None')
+    assert analytics.stats()['events'] == 1
+    analytics = UsageAnalytics('benchmark', registry, directory='.')
+    rng = np.random.default_rng(0)
+    count = days * events_per_day
+    now = wall_seconds()
+    labels = [machine.label for machine in registry]
+    timestamps = np.sort(now - rng.random(count) * days * 86400)
+    actions = rng.choice(len(ACTIONS), size=count, p=[0.3, 0.2, 0.02, 0.03, 0.45])
+    for timestamp, action, machine in zip(timestamps, actions, rng.integers(len(labels), size=count)):
+        analytics.timestamps.append(timestamp)
+        analytics.actions.append(int(action))
+        analytics.machine_ids.append(NO_MACHINE_INDEX if action == REFRESH_STATUS else int(machine))
+        analytics.durations.append(45 if action in (START_CYCLE, SET_CYCLE) else 0)
+        analytics.user_ids.append(0)
+
+    analytics.columns()
+    started = time.perf_counter()
+    stats = analytics.stats(days=days, now=now)
+    elapsed = time.perf_counter() - started
+    print(format_stats(stats, registry))
+    print(f"\n{count} events: stats in {elapsed * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,87 @@
+import os
+import json
+import sqlite3
+import threading
+
+SPOOL_PATH = os.getenv('AUDIT_SPOOL_PATH', 'audit_spool.db')
+COMPACT_THRESHOLD = 500  # Acknowledged records to accumulate before compacting
+
+# Record states
+PENDING = 0
+ACKED = 1
+REJECTED = 2  # Airtable refused the record; kept for inspection, never resent
+
+class AuditSpool:
+    """Append-only SQLite spool of audit records awaiting delivery to Airtable."""
+
+    def __init__(self, path=SPOOL_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " record TEXT NOT NULL,"
+            " state INTEGER NOT NULL DEFAULT 0,"
+            " table_name TEXT)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(events)")]
+        if 'table_name' not in columns:
+            # Spools created before per-tenant tables; NULL means the default table
+            self.conn.execute("ALTER TABLE events ADD COLUMN table_name TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS events_state ON events (state, id)")
+        self.acked_since_compact = 0
+
+    def append(self, record, table_name=None):
+        """Durably append a record bound for `table_name` and return its sequence number."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO events (record, table_name) VALUES (?, ?)", (json.dumps(record), table_name)
+            )
+            return cursor.lastrowid
+
+    def pending(self, limit):
+        """Return up to `limit` unsent records as (id, table_name, record), oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, table_name, record FROM events WHERE state = ? ORDER BY id LIMIT ?",
+                (PENDING, limit)
+            ).fetchall()
+        return [(row_id, table_name, json.loads(record)) for row_id, table_name, record in rows]
+
+    def pending_count(self):
+        """Return the number of unsent records."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM events WHERE state = ?", (PENDING,)
+            ).fetchone()[0]
+
+    def mark(self, ids, state):
+        """Set the delivery state of the given records."""
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE events SET state = ? WHERE id = ?", [(state, row_id) for row_id in ids]
+            )
+        if state == ACKED:
+            self.acked_since_compact += len(ids)
+            if self.acked_since_compact >= COMPACT_THRESHOLD:
+                self.compact()
+
+    def ack(self, ids):
+        """Mark records as delivered."""
+        self.mark(ids, ACKED)
+
+    def reject(self, ids):
+        """Mark records as permanently refused by Airtable."""
+        self.mark(ids, REJECTED)
+
+    def compact(self):
+        """Delete acknowledged records."""
+        with self.lock:
+            self.conn.execute("DELETE FROM events WHERE state = ?", (ACKED,))
+            self.acked_since_compact = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
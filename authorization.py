@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+
+AUTH_FILE = os.getenv('AUTH_FILE')  # Optional JSON file or SQLite database of users and roles
+AUTH_RELOAD_INTERVAL = int(os.getenv('AUTH_RELOAD_INTERVAL', '30'))  # Seconds between change checks
+NEGATIVE_CACHE_TTL = 60  # Seconds to remember that a user is not authorized
+DENIAL_LOG_INTERVAL = 60  # Seconds between logged denials for the same user
+MAX_TRACKED_USERS = 10000  # Per-user entries kept by the negative cache and the denial log
+
+# Roles
+USER = 'user'
+ADMIN = 'admin'
+
+logger = logging.getLogger(__name__)
+
+class AccessList:
+    """Immutable user and admin indexes, by Telegram user ID with a username fallback."""
+
+    def __init__(self, entries=()):
+        user_ids, admin_ids, usernames, admin_usernames = set(), set(), set(), set()
+        for entry in entries:
+            admin = entry.get('role', USER) == ADMIN
+            if entry.get('id') is not None:
+                user_ids.add(int(entry['id']))
+                if admin:
+                    admin_ids.add(int(entry['id']))
+            elif entry.get('username'):
+                # Usernames can change; they are only used for entries without an ID
+                usernames.add(entry['username'])
+                if admin:
+                    admin_usernames.add(entry['username'])
+        self.user_ids = frozenset(user_ids)
+        self.admin_ids = frozenset(admin_ids)
+        self.usernames = frozenset(usernames)
+        self.admin_usernames = frozenset(admin_usernames)
+
+    def role(self, user_id, username):
+        if user_id in self.admin_ids or username in self.admin_usernames:
+            return ADMIN
+        if user_id in self.user_ids or username in self.usernames:
+            return USER
+        return None
+
+def read_entries(path):
+    """
+    Read access entries from a JSON file or SQLite database.
+
+    JSON: {"users": [{"id": 123, "username": "alice", "role": "admin"}, ...]}
+    SQLite: table users(id INTEGER, username TEXT, role TEXT)
+    """
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT id, username, role FROM users").fetchall()
+        finally:
+            conn.close()
+        return [{'id': user_id, 'username': username, 'role': role or USER} for user_id, username, role in rows]
+
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('users', [])
+
+def entries_from_usernames(usernames, admin_usernames=()):
+    """Build access entries from username lists such as AUTHORIZED_USERS."""
+    admins = {name for name in admin_usernames if name}
+    entries = [{'username': name, 'role': ADMIN if name in admins else USER} for name in usernames if name]
+    entries += [{'username': name, 'role': ADMIN} for name in admins - set(usernames)]
+    return entries
+
+def prune(entries, now):
+    """Drop expired entries of {user_id: expiry}; drop all if that is not enough to bound it."""
+    if len(entries) <= MAX_TRACKED_USERS:
+        return entries
+    entries = {user_id: expires for user_id, expires in entries.items() if expires > now}
+    return entries if len(entries) <= MAX_TRACKED_USERS else {}
+
+class DenialLog:
+    """Decides whether to log a denial: at most once per DENIAL_LOG_INTERVAL per user."""
+
+    def __init__(self):
+        self.quiet_until = {}  # user_id -> monotonic time the next denial may be logged
+
+    def should_log(self, user_id):
+        now = time.monotonic()
+        quiet_until = self.quiet_until.get(user_id)
+        if quiet_until is not None and quiet_until > now:
+            return False
+        self.quiet_until = prune(self.quiet_until, now)
+        self.quiet_until[user_id] = now + DENIAL_LOG_INTERVAL
+        return True
+
+class Authorization:
+    """
+    Role lookups for one tenant, hot-reloaded from an optional file.
+
+    Lookups are frozenset membership tests. Unauthorized users are cached
+    for NEGATIVE_CACHE_TTL so repeated presses skip the lookup entirely,
+    and denials are logged at most once per DENIAL_LOG_INTERVAL per user.
+    """
+
+    def __init__(self, static_entries=(), path=None):
+        self.static_entries = list(static_entries)
+        self.path = path
+        self.mtime = None
+        self.access = AccessList(self.static_entries)
+        self.denied_until = {}  # user_id -> monotonic time the negative entry expires
+        self.denials = DenialLog()
+        self.task = None
+        if path:
+            self.reload()
+
+    def role(self, user):
+        """Return ADMIN, USER or None for a Telegram user."""
+        return self.lookup(user.id, user.username)
+
+    def lookup(self, user_id, username=None):
+        """Return ADMIN, USER or None for a user ID and optional username."""
+        now = time.monotonic()
+        denied_until = self.denied_until.get(user_id)
+        if denied_until is not None:
+            if denied_until > now:
+                return None
+            self.denied_until.pop(user_id, None)
+
+        role = self.access.role(user_id, username)
+        if role is None:
+            self.denied_until = prune(self.denied_until, now)
+            self.denied_until[user_id] = now + NEGATIVE_CACHE_TTL
+        return role
+
+    def is_authorized(self, user):
+        return self.role(user) is not None
+
+    def is_admin(self, user):
+        return self.role(user) == ADMIN
+
+    def log_denial(self, user, where):
+        """Log a denied access, rate limited per user."""
+        if self.denials.should_log(user.id):
+            logger.warning("Unauthorized %s by @%s (%s).", where, user.username, user.id)
+
+    def load(self):
+        """
+        Read the access file if it changed, without touching this object.
+
+        Safe to run in a thread. Returns (access list, mtime), or None if
+        there is nothing new.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.error("Cannot read access file %s: %s", self.path, e)
+            return None
+        if mtime == self.mtime:
+            return None
+        return AccessList(self.static_entries + read_entries(self.path)), mtime
+
+    def apply(self, loaded):
+        """Swap in a list from load(); call on the event loop, where lookups run."""
+        if loaded is None:
+            return False
+        # Swap whole indexes so lookups never see a half-built list, and
+        # drop negative entries made against the old one
+        self.access, self.mtime = loaded
+        self.denied_until = {}
+        logger.info("Loaded access list from %s.", self.path)
+        return True
+
+    def reload(self):
+        """Re-read the access file if it changed. Returns True if the lists were replaced."""
+        return self.apply(self.load())
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(AUTH_RELOAD_INTERVAL)
+            try:
+                self.apply(await asyncio.to_thread(self.load))
+            except Exception as e:
+                logger.error("Failed to reload access file %s: %s", self.path, e)
+
+    def start(self):
+        """Start watching the access file for changes."""
+        if self.path:
+            self.task = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
@@ -0,0 +1,333 @@
+"""
+Offline load test of the whole bot against fake Telegram and Airtable backends.
+
+Usage:
+    python benchmark.py [--users 2000] [--updates 2000] [--rate 5] [--peak-rate 20]
+                        [--telegram-latency 0] [--airtable-latency 0] [--failure-rate 0]
+                        [--max-p99-ms 250]
+    python benchmark.py --telegram-latency 0.05 --airtable-latency 0.2 --failure-rate 0.01 --max-p99-ms 0
+    python benchmark.py --workers 3
+
+The real Application, handlers, outbound sender, scheduler and Airtable
+spool run in process; only the Bot API HTTP layer and pyairtable are
+replaced by the fakes in fakes.py. A synthetic update stream ramps from
+--rate up to an evening peak of --peak-rate updates per second (0 means as
+fast as the update queue accepts them, which measures throughput rather
+than latency). The fakes answer instantly unless given a latency and
+failure rate; the second form above models production-like backends,
+where retry_after pauses put p99 well over the default budget, so it only
+reports. Outbound messages go through the real global and per-chat
+rate limits (TELEGRAM_GLOBAL_RATE as in production), so latency includes
+time spent throttled. Reports end-to-end p50/p99 latency, throughput,
+per-handler timings and memory, checks that racing start presses never
+double-book a machine, and exits non-zero when p99 exceeds --max-p99-ms
+(0 disables the check).
+
+With --workers N, N Applications share one in-process state backend
+instead: start presses for one machine race across all of them, then one
+worker crashes while owning timers (one of them leased mid-fire), and the
+others must take every one of them over and fire each exactly once.
+Finally users join a waitlist through different workers, and machines
+freed on any worker must go to them in join order.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import contextlib
+import tracemalloc
+from fakes import FakeBotRequest, FakeApi, scratch_env, running_application
+
+# Keep all state in a scratch directory; must happen before the bot modules read their settings
+scratch_env('washbot-bench-')
+# Short enough for --workers to watch timers being taken over
+os.environ.setdefault('TIMER_POLL_INTERVAL', '1')
+os.environ.setdefault('TIMER_TAKEOVER_GRACE', '1')
+os.environ.setdefault('TIMER_LEASE_TTL', '2')
+
+from telegram import Update
+from telegram.ext import TypeHandler
+import analytics
+import airtable_logger
+import callback_codec
+from fake_telegram_client import make_command_update, make_callback_update
+from metrics import HANDLER_LATENCY
+from main import build_application
+from state_store import MemoryMachineStore
+from shared_state import MemorySharedState
+from logging_setup import setup_logging
+
+TOKEN = '123456:BENCHMARK'
+
+# Per-action INFO lines would dominate the output
+setup_logging(level=logging.WARNING, log_format='text')
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+class UpdateStream:
+    """Synthetic users pressing buttons in roughly the proportions seen in production."""
+
+    def __init__(self, users, admins, registry, seed=0):
+        self.random = random.Random(seed)
+        self.users = list(range(10000, 10000 + users))
+        self.admins = set(self.users[:admins])
+        self.registry = registry
+
+    def next_update(self):
+        user_id = self.random.choice(self.users)
+        machine = self.random.choice(self.registry.machines)
+        roll = self.random.random()
+        if roll < 0.05:
+            return make_command_update(user_id)
+        if roll < 0.20:
+            data = callback_codec.encode(callback_codec.SHOW_STATUS)
+        elif roll < 0.60:
+            data = callback_codec.encode(callback_codec.REFRESH_STATUS)
+        elif roll < 0.80:
+            data = callback_codec.encode(callback_codec.START_MACHINE, machine.token)
+        elif roll < 0.88:
+            data = callback_codec.encode(callback_codec.JOIN_WAITLIST, machine.token)
+        elif roll < 0.92:
+            data = callback_codec.encode(callback_codec.LEAVE_WAITLIST, machine.token)
+        elif roll < 0.96:
+            data = callback_codec.encode(callback_codec.MODIFY_STATUS)
+        else:
+            user_id = self.random.choice(sorted(self.admins))
+            data = callback_codec.encode(callback_codec.SET_TIME, machine.token, self.random.choice((5, 30, 60)))
+        return make_callback_update(user_id, data)
+
+def fast_forward(tenant):
+    """Make every pending cycle end and claim expiry fire now, so free_machine runs under load too."""
+    timers = tenant.shared.timers.get(tenant.id, {})
+    for key, (_, _, callback, args) in list(tenant.scheduler.entries.items()):
+        if key[0] == 'free' and key[1] in timers:
+            # Due now in the (in-process) shared state too, or the lease is refused
+            timers[key[1]] = (0, timers[key[1]][1])
+            tenant.scheduler.schedule(key, 0, callback, *args)
+
+async def run_load(application, stream, updates, rate, peak_rate, cycle_every):
+    """Feed `updates` synthetic updates and return (latencies, seconds taken)."""
+    enqueued = {}
+    latencies = []
+    done = asyncio.Event()
+
+    async def finished(update, context):
+        latencies.append(time.perf_counter() - enqueued.pop(update.update_id))
+        if len(latencies) == updates:
+            done.set()
+
+    # Runs after the bot's own handlers (group 0) for every update
+    application.add_handler(TypeHandler(Update, finished), group=1)
+
+    tenant = next(iter(application.bot_data['tenants']))
+    started = time.perf_counter()
+    for i in range(updates):
+        if peak_rate:
+            # Linear ramp from `rate` to the evening peak
+            current = rate + (peak_rate - rate) * i / updates
+            await asyncio.sleep(stream.random.expovariate(max(current, 1)))
+        update = Update.de_json(stream.next_update(), application.bot)
+        enqueued[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+        if cycle_every and i % cycle_every == cycle_every - 1:
+            fast_forward(tenant)
+
+    await asyncio.wait_for(done.wait(), timeout=120)
+    return latencies, time.perf_counter() - started
+
+async def race(application, presses):
+    """Press start on one free machine from `presses` users at once; exactly one may win."""
+    tenant = next(iter(application.bot_data['tenants']))
+    machine = next(m for m in tenant.registry if tenant.machines[m.id]['status'] == 'free')
+    users = range(50000, 50000 + presses)
+    updates = [
+        Update.de_json(make_callback_update(user_id, callback_codec.encode(callback_codec.START_MACHINE, machine.token)), application.bot)
+        for user_id in users
+    ]
+    await asyncio.gather(*(application.process_update(update) for update in updates))
+    info = tenant.machines[machine.id]
+    assert info['status'] == 'occupied', f"{machine.name} is {info['status']} after the race"
+    assert info['user_id'] in users, "the race winner is not one of the racing users"
+    # The local copy, the shared state and the store must all name the same winner and cycle
+    shared = await tenant.shared.machine(tenant.id, machine.id)
+    stored = tenant.store.load_active().get(tenant.state_key(machine.id))
+    assert shared['cycle'] == info['cycle'] and shared['user_id'] == info['user_id'], (shared, info)
+    assert stored and stored['cycle'] == info['cycle'] and stored['user_id'] == info['user_id'], (stored, info)
+    machine_index = tenant.analytics.machine_index[machine.label]
+    starts = sum(
+        1 for action, index in zip(tenant.analytics.actions, tenant.analytics.machine_ids)
+        if action == analytics.START_CYCLE and index == machine_index
+    )
+    assert starts == 1, f"{starts} cycles were started on {machine.name}"
+    return machine, info['user_id']
+
+async def benchmark(args):
+    tracemalloc.start()
+    fake_bot = FakeBotRequest(latency=args.telegram_latency, failure_rate=args.failure_rate, seed=1)
+    fake_airtable = FakeApi(latency=args.airtable_latency, failure_rate=args.failure_rate, seed=2)
+    airtable_logger.api = fake_airtable
+    airtable_logger.tables.clear()
+
+    stream_users = [f"user{user_id}" for user_id in range(10000, 10000 + args.users)]
+    race_users = [f"user{user_id}" for user_id in range(50000, 50000 + args.race)]
+    application = build_application(
+        TOKEN,
+        mode='webhook',
+        request=fake_bot,
+        authorized_users=stream_users + race_users,
+        admin_users=stream_users[:args.admins]
+    )
+    stream = UpdateStream(args.users, args.admins, next(iter(application.bot_data['tenants'])).registry)
+
+    async with running_application(application):
+        machine, winner = await race(application, args.race)
+        print(f"Race: {args.race} users pressed start on {machine.name}; only user {winner} got it.")
+        # The handler table reports the load run only
+        HANDLER_LATENCY.series.clear()
+
+        latencies, elapsed = await run_load(
+            application, stream, args.updates, args.rate, args.peak_rate, args.cycle_every
+        )
+
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    print(f"\n{len(latencies)} updates in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} updates/s")
+    print(f"End-to-end latency: p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    print(f"Peak traced memory: {peak_memory / 2**20:.1f} MiB")
+
+    print("\nHandler               calls   mean ms")
+    for (handler,), series in sorted(HANDLER_LATENCY.series.items()):
+        count = sum(series[:-1])
+        print(f"{handler:<20} {count:>6} {series[-1] / count * 1000:>9.2f}")
+
+    print(f"\nBot API calls: {dict(fake_bot.calls)}, injected failures: {dict(fake_bot.failures)}")
+    records = fake_airtable.records()
+    starts = sum(1 for record in records if record['Action'] == 'Start Cycle')
+    print(f"Airtable: {len(records)} records delivered ({starts} Start Cycle), "
+          f"{sum(table.requests for table in fake_airtable.tables.values())} requests")
+
+    if args.max_p99_ms and p99 * 1000 > args.max_p99_ms:
+        print(f"FAIL: p99 {p99 * 1000:.1f} ms exceeds the {args.max_p99_ms} ms budget")
+        return 1
+    return 0
+
+async def cluster(args):
+    """Run the multi-worker checks; returns the exit status."""
+    shared = MemorySharedState()
+    fake_airtable = FakeApi(seed=2)
+    airtable_logger.api = fake_airtable
+    airtable_logger.tables.clear()
+    # Racers, then the users of the waitlist check
+    users = [f"user{user_id}" for user_id in list(range(50000, 50000 + args.race)) + list(range(60000, 60200))]
+    workers = [
+        build_application(
+            TOKEN, mode='webhook', request=FakeBotRequest(seed=i), store=MemoryMachineStore(), shared_state=shared,
+            authorized_users=users, admin_users=users[:1]
+        )
+        for i in range(args.workers)
+    ]
+
+    def set_free_counts():
+        counts = {}
+        for application in workers:
+            tenant = next(iter(application.bot_data['tenants']))
+            labels = {i: machine.id for i, machine in enumerate(tenant.registry)}
+            for action, index in zip(tenant.analytics.actions, tenant.analytics.machine_ids):
+                if action == analytics.SET_FREE:
+                    counts[labels[index]] = counts.get(labels[index], 0) + 1
+        return counts
+
+    async with contextlib.AsyncExitStack() as stack:
+        for application in workers:
+            await stack.enter_async_context(running_application(application))
+
+        tenant = next(iter(workers[0].bot_data['tenants']))
+        machines = list(tenant.registry)
+        presses = [
+            workers[i % len(workers)].process_update(Update.de_json(
+                make_callback_update(50000 + i, callback_codec.encode(callback_codec.START_MACHINE, machines[0].token)),
+                workers[i % len(workers)].bot
+            ))
+            for i in range(args.race)
+        ]
+        await asyncio.gather(*presses)
+        _, state = await shared.machines(tenant.id)
+        starts = sum(
+            1 for application in workers
+            for action in next(iter(application.bot_data['tenants'])).analytics.actions if action == analytics.START_CYCLE
+        )
+        assert state[machines[0].id]['status'] == 'occupied' and starts == 1, f"{starts} cycles started"
+        print(f"Race: {args.race} presses over {len(workers)} workers; only user {state[machines[0].id]['user_id']} got it.")
+
+        # The crashing worker starts the other machines and so owns their timers
+        for i, machine in enumerate(machines[1:]):
+            await workers[0].process_update(Update.de_json(
+                make_callback_update(50000 + i, callback_codec.encode(callback_codec.START_MACHINE, machine.token)),
+                workers[0].bot
+            ))
+        timers = shared.timers[tenant.id]
+        for name in timers:
+            timers[name] = (0, timers[name][1])
+        # Worker 0 dies holding the lease of one timer, and with the rest still scheduled
+        await shared.claim_timer(tenant.id, machines[-1].id, workers[0].bot_data['worker_id'])
+        await tenant.scheduler.stop()
+
+        started = time.perf_counter()
+        while timers and time.perf_counter() - started < 30:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        _, state = await shared.machines(tenant.id)
+        counts = set_free_counts()
+        assert not timers, f"timers left: {sorted(timers)}"
+        assert all(state[machine.id]['status'] == 'free' for machine in machines), state
+        assert all(counts.get(machine.id) == 1 for machine in machines), f"Set Free per machine: {counts}"
+        print(f"Takeover: {len(machines)} timers of the crashed worker fired exactly once by the others in {elapsed:.1f}s.")
+
+        # Users queue on different workers; whichever worker frees a machine serves them in join order
+        live = workers[1:]
+
+        async def press(worker, user_id, action, machine):
+            await worker.process_update(Update.de_json(
+                make_callback_update(user_id, callback_codec.encode(action, machine.token)), worker.bot
+            ))
+        same_type = [machine for machine in machines if machine.type == machines[0].type]
+        for i, machine in enumerate(machines):
+            await press(live[i % len(live)], 60000 + i, callback_codec.START_MACHINE, machine)
+        waiting = [60100 + i for i in range(len(same_type))]
+        for i, user_id in enumerate(waiting):
+            await press(live[-1 - i % len(live)], user_id, callback_codec.JOIN_WAITLIST, machines[0])
+        for i, (machine, user_id) in enumerate(zip(same_type, waiting)):
+            await press(live[i % len(live)], 50000, callback_codec.SET_FREE, machine)
+            info = await shared.machine(tenant.id, machine.id)
+            assert info['status'] == 'reserved' and info['user_id'] == user_id, f"{machine.id} went to {info}"
+        print(f"Waitlist: {len(waiting)} users queued on different workers got their machines in join order.")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--admins', type=int, default=5)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=5, help="Starting updates per second")
+    parser.add_argument('--peak-rate', type=float, default=20, help="Peak updates per second; 0 for no pacing")
+    parser.add_argument('--race', type=int, default=200, help="Users racing for one machine")
+    parser.add_argument('--cycle-every', type=int, default=200, help="End running cycles every N updates")
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help="Seconds per Bot API call")
+    parser.add_argument('--airtable-latency', type=float, default=0.0, help="Seconds per Airtable request")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of calls to either that fail")
+    parser.add_argument('--max-p99-ms', type=float, default=250, help="p99 latency budget; 0 to only report")
+    parser.add_argument('--workers', type=int, default=1, help="Check scale-out with N workers instead")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(cluster(args) if args.workers > 1 else benchmark(args)))
+
+if __name__ == '__main__':
+    main()
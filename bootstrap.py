@@ -0,0 +1,118 @@
+"""
+Application entry point.
+
+Loads .env once, sets up logging, then imports and builds the bot, timing
+each phase up to the first handled update. The timings are logged and
+exported as washbot_startup_seconds. Modules read their settings from the
+environment at import time, so nothing else calls load_dotenv.
+
+Usage:
+    python bootstrap.py
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import os
+import sys
+import asyncio
+import logging
+import contextlib
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """Durations of the startup phases and the time until the first update reached the handlers."""
+
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.phases = []  # (name, seconds), in order
+        self.first_update = None  # Seconds since `started`
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases)
+
+    def samples(self):
+        """Gauge samples: each phase, and first_update once it is known."""
+        for name, seconds in self.phases:
+            yield (name,), seconds
+        if self.first_update is not None:
+            yield ('first_update',), self.first_update
+
+    async def update_received(self, update, context):
+        """Handler run before all others (group -2); reports startup once the first update arrives."""
+        if self.first_update is None:
+            self.first_update = time.perf_counter() - self.started
+            logger.info("Startup: %s; first update after %.0f ms", self.summary(), self.first_update * 1000)
+
+def bootstrap(token=None, timer=None, **options):
+    """
+    Load settings, set up logging and build the Application.
+
+    `token` defaults to TELEGRAM_BOT_TOKEN; `options` go to main.build_application.
+    Raises ValueError, after logging is set up, if there is no token.
+    """
+    timer = timer or StartupTimer()
+    with timer.phase('settings'):
+        load_dotenv()
+    with timer.phase('logging'):
+        from logging_setup import setup_logging
+        setup_logging()
+    token = token or os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise ValueError("TELEGRAM_BOT_TOKEN is not set in environment variables.")
+    with timer.phase('imports'):
+        from telegram import Update
+        from telegram.ext import TypeHandler
+        from metrics import REGISTRY, Gauge
+        import main
+    with timer.phase('build'):
+        application = main.build_application(token, **options)
+
+    post_init = application.post_init
+
+    async def timed_post_init(application):
+        with timer.phase('post_init'):
+            await post_init(application)
+        logger.info("Ready after %.0f ms: %s", (time.perf_counter() - timer.started) * 1000, timer.summary())
+
+    application.post_init = timed_post_init
+    application.add_handler(TypeHandler(Update, timer.update_received), group=-2)
+    application.bot_data['startup'] = timer
+    REGISTRY.register(Gauge('washbot_startup_seconds', 'Duration of each startup phase.', ('phase',), timer.samples))
+    return application
+
+def run():
+    """Start the bot."""
+    try:
+        application = bootstrap()
+    except ValueError as e:
+        logger.error("%s", e)
+        sys.exit(1)
+
+    mode = application.bot_data['mode']
+    logger.info("Serving %s tenant(s) in %s mode.", len(application.bot_data['tenants']), mode)
+
+    try:
+        if mode == 'webhook':
+            from webhook_server import serve_webhook
+            asyncio.run(serve_webhook(application))
+        else:
+            application.run_polling()
+    except Exception as e:
+        logger.error("An error occurred: %s", e)
+        sys.exit(1)
+
+    logger.info("Bot has stopped. Exiting application.")
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,96 @@
+"""
+Compact callback_data encoding.
+
+Button data is "<action>[:<machine token>[:<argument>]]", e.g. "t:uw1:45"
+for "set Upper Floor Washer 1 to 45 minutes". Actions are single
+characters, so every button stays far below Telegram's 64-byte limit and
+decoding is one split plus a dict lookup.
+"""
+
+# Action IDs
+SHOW_STATUS = 's'
+REFRESH_STATUS = 'r'
+START_MACHINE = 'g'
+MODIFY_STATUS = 'm'
+SELECT_MACHINE = 'e'
+SET_FREE = 'f'
+SET_BROKEN = 'b'
+SET_TIME = 't'
+CANCEL_MODIFICATION = 'c'
+JOIN_WAITLIST = 'w'
+LEAVE_WAITLIST = 'l'
+
+# Actions that must name a machine
+MACHINE_ACTIONS = frozenset({
+    START_MACHINE, SELECT_MACHINE, SET_FREE, SET_BROKEN, SET_TIME, JOIN_WAITLIST, LEAVE_WAITLIST
+})
+
+SEPARATOR = ':'
+
+# Data on buttons sent before this encoding existed
+LEGACY_CALLBACKS = {
+    'show_status': SHOW_STATUS,
+    'refresh_status': REFRESH_STATUS,
+    'modify_status': MODIFY_STATUS,
+    'cancel_modification': CANCEL_MODIFICATION,
+}
+
+def encode(action, machine_token=None, argument=None):
+    """Encode an action, optional machine token and optional argument."""
+    if argument is not None:
+        return f"{action}{SEPARATOR}{machine_token or ''}{SEPARATOR}{argument}"
+    if machine_token is not None:
+        return f"{action}{SEPARATOR}{machine_token}"
+    return action
+
+def decode(data):
+    """Decode callback data into (action, machine_token, argument); missing parts are None."""
+    legacy = LEGACY_CALLBACKS.get(data)
+    if legacy:
+        return legacy, None, None
+    parts = data.split(SEPARATOR, 2)
+    action = parts[0]
+    machine_token = (parts[1] or None) if len(parts) > 1 else None
+    argument = parts[2] if len(parts) > 2 else None
+    return action, machine_token, argument
+
+def benchmark(rounds=200000):
+    """Compare routing cost per update against the former regex/startswith routing."""
+    import re
+    import timeit
+
+    samples = ['refresh_status', 'start_Upper Floor Washer 1️⃣ 🌊', 'select_machine_Ground Floor Dryer ☀️', 'set_time_45']
+    patterns = [re.compile(p) for p in (
+        '^modify_status$', '^select_machine_', '^cancel_modification$', '^set_status_', '^set_time_'
+    )]
+
+    def legacy_route(data):
+        # ConversationHandler pattern checks, then button_click_handler's chain
+        for pattern in patterns:
+            if pattern.match(data):
+                return pattern
+        if data in ['show_status', 'refresh_status']:
+            return data
+        if data == 'modify_status':
+            return data
+        if data.startswith('start_'):
+            return data.split('start_')[1]
+
+    table = {action: action for action in (
+        SHOW_STATUS, REFRESH_STATUS, START_MACHINE, MODIFY_STATUS, SELECT_MACHINE,
+        SET_FREE, SET_BROKEN, SET_TIME, CANCEL_MODIFICATION
+    )}
+    encoded = [encode(REFRESH_STATUS), encode(START_MACHINE, 'uw1'), encode(SELECT_MACHINE, 'gd'), encode(SET_TIME, 'uw1', 45)]
+
+    def route(data):
+        action, machine_token, argument = decode(data)
+        return table[action], machine_token, argument
+
+    for name, func, inputs in (('legacy', legacy_route, samples), ('codec', route, encoded)):
+        seconds = timeit.timeit(lambda: [func(data) for data in inputs], number=rounds)
+        per_update = seconds / (rounds * len(inputs)) * 1e9
+        longest = max(len(data.encode()) for data in inputs)
+        print(f"{name:>6}: {per_update:7.1f} ns/update, longest callback_data {longest} bytes")
+
+if __name__ == '__main__':
+    benchmark()
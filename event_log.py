@@ -0,0 +1,213 @@
+"""
+Event-sourced machine state.
+
+Every state transition and every logged action is appended to an
+immutable SQLite event log. The current state is a fold over the state
+events, kept in memory and written out as a snapshot every
+SNAPSHOT_INTERVAL events, so startup reads one snapshot plus a short tail.
+The same fold answers "what did the machines look like at time T", and
+derived views (analytics, the Airtable log) can be rebuilt by streaming the
+action events once.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from state_store import MachineStore, encode_info, decode_info, STATE_DB_PATH
+
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '1000'))  # State events between snapshots
+STREAM_CHUNK = 1000  # Events fetched per round trip when streaming
+
+# Event kinds
+STATE = 'state'  # key: "<tenant>/<machine>", data: encoded machine info
+ACTION = 'action'  # key: tenant ID, data: the action as logged to Airtable
+
+def fold(state, key, data):
+    """Apply one state event to {key: encoded info}; free machines are dropped."""
+    if json.loads(data).get('status') == 'free':
+        state.pop(key, None)
+    else:
+        state[key] = data
+
+class EventLogStore(MachineStore):
+    """MachineStore that keeps the full history as an append-only event log."""
+
+    keeps_history = True
+
+    def __init__(self, path=STATE_DB_PATH, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " time REAL NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS events_time ON events (time)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (seq INTEGER PRIMARY KEY, time REAL NOT NULL, state TEXT NOT NULL)"
+        )
+        self.state, self.last_seq = self.replay()
+        snapshot = self.latest_snapshot()
+        self.since_snapshot = self.conn.execute(
+            "SELECT COUNT(*) FROM events WHERE kind = ? AND seq > ?", (STATE, snapshot[0] if snapshot else 0)
+        ).fetchone()[0]
+        self.migrate()
+
+    def migrate(self):
+        """Seed the log from the table kept by SQLiteMachineStore, if this database has one."""
+        if self.last_seq:
+            return
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'machines'"
+        ).fetchone()
+        if exists:
+            for key, data in self.conn.execute("SELECT name, info FROM machines").fetchall():
+                self.append(STATE, key, data)
+
+    def latest_snapshot(self, before=None):
+        """Return (seq, time, state) of the newest snapshot, or of the newest taken at or before `before`."""
+        if before is None:
+            return self.conn.execute("SELECT seq, time, state FROM snapshots ORDER BY seq DESC LIMIT 1").fetchone()
+        return self.conn.execute(
+            "SELECT seq, time, state FROM snapshots WHERE time <= ? ORDER BY seq DESC LIMIT 1", (before,)
+        ).fetchone()
+
+    def replay(self, until=None):
+        """Fold state events from the latest usable snapshot; returns ({key: encoded info}, last seq)."""
+        with self.lock:
+            snapshot = self.latest_snapshot(until)
+            state = json.loads(snapshot[2]) if snapshot else {}
+            last_seq = snapshot[0] if snapshot else 0
+            query = "SELECT seq, key, data FROM events WHERE kind = ? AND seq > ?"
+            params = [STATE, last_seq]
+            if until is not None:
+                query += " AND time <= ?"
+                params.append(until)
+            for seq, key, data in self.conn.execute(query + " ORDER BY seq", params):
+                fold(state, key, data)
+                last_seq = seq
+            if until is None:
+                last_seq = max(last_seq, self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0])
+        return state, last_seq
+
+    def append(self, kind, key, data):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO events (time, kind, key, data) VALUES (?, ?, ?, ?)", (time.time(), kind, key, data)
+            )
+            self.last_seq = cursor.lastrowid
+        if kind == STATE:
+            fold(self.state, key, data)
+            self.since_snapshot += 1
+            if self.since_snapshot >= self.snapshot_interval:
+                self.snapshot()
+
+    def snapshot(self):
+        """Write the current folded state, so later replays start here."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshots (seq, time, state) VALUES (?, ?, ?)",
+                (self.last_seq, time.time(), json.dumps(self.state))
+            )
+        self.since_snapshot = 0
+
+    def save(self, machine_name, info):
+        self.append(STATE, machine_name, encode_info(info))
+
+    def save_action(self, tenant_id, fields):
+        self.append(ACTION, tenant_id, json.dumps(fields))
+
+    def load_active(self):
+        return {key: decode_info(data) for key, data in self.state.items()}
+
+    def state_at(self, when):
+        """Return {key: info} for every machine that was not free at `when` (epoch seconds)."""
+        state, _ = self.replay(until=when)
+        return {key: decode_info(data) for key, data in state.items()}
+
+    def stream(self, kind, key=None):
+        """
+        Yield (time, key, decoded data) for events of one kind, oldest first.
+
+        Reads through its own connection, so it sees the log as of the first
+        fetch and never blocks writers; fetched STREAM_CHUNK rows at a time.
+        """
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            query = "SELECT time, key, data FROM events WHERE kind = ?"
+            params = [kind]
+            if key is not None:
+                query += " AND key = ?"
+                params.append(key)
+            cursor = conn.execute(query + " ORDER BY seq", params)
+            while True:
+                rows = cursor.fetchmany(STREAM_CHUNK)
+                if not rows:
+                    break
+                for when, event_key, data in rows:
+                    yield when, event_key, json.loads(data)
+        finally:
+            conn.close()
+
+    def close(self):
+        # The next startup then only reads the snapshot
+        if self.since_snapshot:
+            self.snapshot()
+        with self.lock:
+            self.conn.close()
+
+async def replay_actions(store, tenant_id, sinks):
+    """
+    Feed every action logged for a tenant to each sink(when, fields) in one pass.
+
+    Runs on the event loop, yielding to other tasks every STREAM_CHUNK events.
+    Actions logged while the replay runs are not part of it. Returns the
+    number of actions replayed.
+    """
+    count = 0
+    for when, _, fields in store.stream(ACTION, tenant_id):
+        for sink in sinks:
+            sink(when, fields)
+        count += 1
+        if count % STREAM_CHUNK == 0:
+            await asyncio.sleep(0)
+    return count
+
+def benchmark(events=200000, machines=40):
+    """Time startup and a point-in-time query over a synthetic log, with and without snapshots."""
+    import random
+    import tempfile
+    import datetime
+    directory = tempfile.mkdtemp(prefix='event-log-')
+    for label, interval in (('no snapshots', events + 1), (f"a snapshot every {SNAPSHOT_INTERVAL}", SNAPSHOT_INTERVAL)):
+        path = os.path.join(directory, f"{interval}.db")
+        store = EventLogStore(path, snapshot_interval=interval)
+        rng = random.Random(0)
+        for i in range(events):
+            status = rng.choice(('occupied', 'free', 'free', 'broken'))
+            info = {'status': status, 'end_time': datetime.datetime.now()} if status == 'occupied' else {'status': status}
+            store.save(f"default/machine{rng.randrange(machines)}", info)
+            if i == events // 2:
+                middle = time.time()
+        store.conn.close()  # Without the snapshot close() would write
+
+        started = time.perf_counter()
+        store = EventLogStore(path, snapshot_interval=interval)
+        startup = time.perf_counter() - started
+        started = time.perf_counter()
+        store.state_at(middle)
+        query = time.perf_counter() - started
+        print(f"{events} events, {label}: startup {startup * 1000:.1f} ms, state at a past time {query * 1000:.1f} ms")
+        store.conn.close()
+
+if __name__ == '__main__':
+    benchmark()
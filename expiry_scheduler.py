@@ -0,0 +1,126 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+STOP_TIMEOUT = 10  # Seconds stop() waits for callbacks that are already running
+
+logger = logging.getLogger(__name__)
+
+class ExpiryScheduler:
+    """
+    Run timed callbacks from a single task.
+
+    Entries live in a min-heap ordered by deadline and are addressed by key.
+    Scheduling an existing key replaces it and cancelling is a dict removal;
+    the superseded heap entries are skipped when they reach the top, and the
+    heap is rebuilt once more than half of it is stale.
+    """
+
+    def __init__(self):
+        self.heap = []  # (deadline, seq, key)
+        self.entries = {}  # key -> (deadline, seq, callback, args)
+        self.counter = itertools.count()
+        self.wakeup = None
+        self.task = None
+        self.firing = set()  # Tasks of callbacks that are running
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, delay, callback, *args):
+        """Run `await callback(*args)` after `delay` seconds, replacing any entry under `key`."""
+        deadline = time.monotonic() + max(delay, 0)
+        seq = next(self.counter)
+        self.entries[key] = (deadline, seq, callback, args)
+        heapq.heappush(self.heap, (deadline, seq, key))
+        self.compact()
+        if self.wakeup and self.heap[0][1] == seq:
+            self.wakeup.set()
+
+    def cancel(self, key):
+        """Cancel the entry under `key`. Returns True if one was pending."""
+        if self.entries.pop(key, None) is None:
+            return False
+        self.compact()
+        return True
+
+    def remaining(self, key):
+        """Return seconds until the entry under `key` fires, or None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return max(entry[0] - time.monotonic(), 0)
+
+    def compact(self):
+        """Rebuild the heap when stale entries outnumber live ones."""
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            self.heap = [(deadline, seq, key) for key, (deadline, seq, _, _) in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def is_stale(self, heap_entry):
+        entry = self.entries.get(heap_entry[2])
+        return entry is None or entry[1] != heap_entry[1]
+
+    async def run(self):
+        """Fire due entries until cancelled."""
+        while True:
+            while self.heap and self.is_stale(self.heap[0]):
+                heapq.heappop(self.heap)
+
+            if not self.heap:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            delay = self.heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            _, _, key = heapq.heappop(self.heap)
+            _, _, callback, args = self.entries.pop(key)
+            task = asyncio.create_task(self.fire(key, callback, args))
+            self.firing.add(task)
+            task.add_done_callback(self.firing.discard)
+
+    async def fire(self, key, callback, args):
+        try:
+            await callback(*args)
+        except Exception as e:
+            logger.error("Scheduled callback %s failed: %s", key, e)
+
+    def start(self):
+        """Start the scheduler task on the running event loop."""
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the scheduler task; pending entries are kept.
+
+        Callbacks that already fired get up to `timeout` seconds to finish,
+        so they are done before whatever they use (e.g. the sender) stops;
+        the rest are cancelled.
+        """
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        if self.firing:
+            _, running = await asyncio.wait(set(self.firing), timeout=timeout)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
@@ -0,0 +1,144 @@
+"""
+Post synthetic Telegram updates to a locally running webhook server.
+
+Usage: BOT_MODE=webhook WEBHOOK_SECRET=... python bootstrap.py, then
+    python fake_telegram_client.py [--url http://localhost:8443/telegram] [--count 200]
+or, fully offline, with the bot served in this process against the Bot API fake:
+    python fake_telegram_client.py --serve
+
+Checks the secret-token check, the health endpoint and how the server
+responds under a burst of updates.
+"""
+import os
+import json
+import time
+import asyncio
+import secrets
+import argparse
+import itertools
+import urllib.parse
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import callback_codec
+from webhook_server import WEBHOOK_PATH, WEBHOOK_PORT, SECRET_HEADER
+
+update_ids = itertools.count(1)
+
+def make_user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'username': f"user{user_id}"}
+
+def make_command_update(user_id, text='/start'):
+    """Build a message update carrying a bot command."""
+    return {
+        'update_id': next(update_ids),
+        'message': {
+            'message_id': next(update_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        }
+    }
+
+def make_callback_update(user_id, data):
+    """Build a callback query update for an inline button press."""
+    return {
+        'update_id': next(update_ids),
+        'callback_query': {
+            'id': str(next(update_ids)),
+            'chat_instance': str(user_id),
+            'from': make_user(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'Machine Statuses'
+            }
+        }
+    }
+
+def post_update(url, update, secret):
+    """POST one update and return (status code, seconds taken)."""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret or ''}
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+def check_server(args):
+    """Post the burst of updates to a running server and print the results."""
+    base_url = args.url[:-len(WEBHOOK_PATH)] if args.url.endswith(WEBHOOK_PATH) else args.url
+    with urllib.request.urlopen(f"{base_url}/healthz") as response:
+        print(f"Health: {json.load(response)}")
+
+    status, _ = post_update(args.url, make_command_update(1), 'wrong-secret')
+    print(f"Wrong secret token -> HTTP {status} (expected 403)")
+
+    updates = [
+        make_command_update(user_id) if i % 5 == 0 else make_callback_update(user_id, callback_codec.encode(callback_codec.REFRESH_STATUS))
+        for i, user_id in enumerate(range(1000, 1000 + args.count))
+    ]
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda update: post_update(args.url, update, args.secret), updates))
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(seconds for _, seconds in results)
+    print(f"Posted {len(results)} updates: {statuses}")
+    print(f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000:.1f} ms")
+
+async def serve_and_check(args):
+    """Serve the bot in process against the Bot API fake, without registering a webhook, and check it."""
+    from fakes import FakeBotRequest, FakeApi, scratch_env
+    scratch_env('washbot-webhook-')
+    from bootstrap import bootstrap
+    from webhook_server import serve_webhook
+    import airtable_logger
+
+    airtable_logger.api = FakeApi()
+    users = [f"user{user_id}" for user_id in range(1000, 1000 + args.count)]
+    application = bootstrap('123456:OFFLINE', mode='webhook', request=FakeBotRequest(), authorized_users=users)
+    stop_event = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(
+        application, urllib.parse.urlsplit(args.url).port, args.secret, register=False, stop_event=stop_event
+    ))
+    try:
+        while not application.running:
+            if server.done():
+                return await server
+            await asyncio.sleep(0.05)
+        await asyncio.to_thread(check_server, args)
+    finally:
+        stop_event.set()
+        await server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default=f"http://localhost:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET'))
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--serve', action='store_true', help="Serve the bot in this process, offline")
+    args = parser.parse_args()
+
+    if args.serve:
+        args.secret = args.secret or secrets.token_urlsafe(32)
+        asyncio.run(serve_and_check(args))
+    else:
+        check_server(args)
+
+if __name__ == '__main__':
+    main()
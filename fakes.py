@@ -0,0 +1,184 @@
+"""
+In-process fakes of the Telegram Bot API and Airtable, for benchmark.py.
+
+FakeBotRequest plugs into python-telegram-bot as the HTTP layer, so the
+real Bot, Application and handlers run unchanged; FakeApi stands in for
+pyairtable's Api. Both take a latency (seconds, with jitter) and a failure
+rate, to see how the bot behaves when either service is slow or flaky.
+
+scratch_env() and running_application() are the setup the offline scripts
+share. This module must not import the bot modules, so that scratch_env()
+can run before they read their settings.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import itertools
+import tempfile
+import threading
+import contextlib
+from collections import Counter
+import requests
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'WashBot', 'username': 'washbot'}
+
+class FakeBotRequest(BaseRequest):
+    """
+    Answer Bot API calls in process.
+
+    Failures alternate between 429 (with retry_after) and 500 responses.
+    Every call is counted per method in `calls`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.5, failure_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.failures = Counter()
+        self.message_ids = itertools.count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self.jitter * (self.random.random() * 2 - 1)))
+
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.failures[api_method] += 1
+            if self.failures[api_method] % 2:
+                return 429, self.error(429, f"Too Many Requests: retry after {self.retry_after}",
+                                       parameters={'retry_after': self.retry_after})
+            return 500, self.error(500, "Internal Server Error")
+
+        return 200, json.dumps({'ok': True, 'result': self.result(api_method, parameters)}).encode()
+
+    @staticmethod
+    def error(code, description, **extra):
+        return json.dumps({'ok': False, 'error_code': code, 'description': description, **extra}).encode()
+
+    def result(self, api_method, parameters):
+        if api_method == 'getMe':
+            return dict(BOT_USER, can_join_groups=True, can_read_all_group_messages=False, supports_inline_queries=False)
+        if api_method in ('sendMessage', 'editMessageText'):
+            message = {
+                'message_id': parameters.get('message_id') or next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': parameters['chat_id'], 'type': 'private'},
+                'from': BOT_USER,
+                'text': parameters.get('text', ''),
+            }
+            if parameters.get('reply_markup'):
+                message['reply_markup'] = parameters['reply_markup']
+            return message
+        # answerCallbackQuery, deleteMessage, setWebhook, deleteWebhook, ...
+        return True
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+class FakeTable:
+    """Stand-in for a pyairtable Table that keeps created records in memory."""
+
+    def __init__(self, name, latency=0.0, failure_rate=0.0, seed=None):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.records = []
+        self.requests = 0
+        self.lock = threading.Lock()  # Called from worker threads
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+            failed = self.failure_rate and self.random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            error = requests.exceptions.HTTPError("503 Service Unavailable")
+            error.response = FakeResponse(503)
+            raise error
+
+    def create(self, fields):
+        self.request()
+        with self.lock:
+            self.records.append(fields)
+        return {'id': f"rec{len(self.records)}", 'fields': fields}
+
+    def batch_create(self, records):
+        self.request()
+        with self.lock:
+            self.records.extend(records)
+        return [{'id': f"rec{i}", 'fields': fields} for i, fields in enumerate(records)]
+
+class FakeApi:
+    """Stand-in for pyairtable.Api; tables share its latency and failure rate."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.tables = {}
+
+    def table(self, base_id, table_name):
+        table = self.tables.get(table_name)
+        if table is None:
+            table = self.tables[table_name] = FakeTable(table_name, self.latency, self.failure_rate, self.seed)
+        return table
+
+    def records(self):
+        return [record for table in self.tables.values() for record in table.records]
+
+def scratch_env(prefix, environ=os.environ):
+    """
+    Keep all bot state in a new scratch directory, offline.
+
+    Fills in the state settings in `environ` unless already set and drops
+    TENANTS_FILE and AUTH_FILE, so the single default tenant is used.
+    Returns `environ`.
+    """
+    scratch = tempfile.mkdtemp(prefix=prefix)
+    environ.setdefault('STATE_BACKEND', 'memory')
+    environ.setdefault('AUDIT_SPOOL_PATH', os.path.join(scratch, 'audit_spool.db'))
+    environ.setdefault('ANALYTICS_DIR', os.path.join(scratch, 'analytics'))
+    environ.pop('TENANTS_FILE', None)
+    environ.pop('AUTH_FILE', None)
+    return environ
+
+@contextlib.asynccontextmanager
+async def running_application(application):
+    """Run an Application with its post_init/post_stop/post_shutdown hooks, as run_polling would."""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        yield application
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
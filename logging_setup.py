@@ -0,0 +1,131 @@
+"""
+Structured logging through a background thread.
+
+Handlers and workers only put log records on an in-memory queue; a
+QueueListener thread formats them as JSON lines and writes them to stdout,
+so slow stdout never shows up in handler latency. Messages use %-style
+arguments and are formatted by the listener, not the caller.
+
+Each record carries the correlation fields bound for the current update or
+timer (update ID, user, machine), so the Telegram update, the state change
+and the Airtable spool entry it produced can be found together.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json', or 'text' for local development
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CORRELATION_FIELDS = ('update_id', 'user_id', 'machine')
+
+correlation = contextvars.ContextVar('correlation', default={})
+
+def bind(**fields):
+    """Add correlation fields for the rest of the current update or task."""
+    correlation.set({**correlation.get(), **fields})
+
+def bind_update(update):
+    """Start a new correlation context for a Telegram update."""
+    user = update.effective_user
+    correlation.set({'update_id': update.update_id, 'user_id': user.id if user else None})
+
+async def correlate_update(update, context):
+    """Handler run before all others (group -1) to tag the update's log records."""
+    bind_update(update)
+
+class CorrelationFilter(logging.Filter):
+    """Copy the caller's correlation fields onto the record before it leaves the caller's context."""
+
+    def filter(self, record):
+        fields = correlation.get()
+        for name in CORRELATION_FIELDS:
+            setattr(record, name, fields.get(name))
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in CORRELATION_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with the correlation fields appended."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(
+            f"{name}={getattr(record, name)}" for name in CORRELATION_FIELDS if getattr(record, name, None) is not None
+        )
+        return f"{line} [{fields}]" if fields else line
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records without formatting them.
+
+    The stock QueueHandler merges the message and its arguments in the
+    calling thread; here only the traceback is rendered eagerly (it holds
+    live frames), and the listener does the rest. Arguments must therefore
+    not be mutated after the call, which holds for the ints and strings
+    this bot logs.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+listener = None
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    """Route all logging through a queue to a background writer thread. Safe to call more than once."""
+    global listener
+    if listener is not None:
+        logging.getLogger().setLevel(level)
+        return listener
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # Every request would otherwise log a line at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+    return listener
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
@@ -0,0 +1,22 @@
+import asyncio
+
+class MachineLocks:
+    """
+    Per-machine asyncio locks, created on first use.
+
+    Handlers that read and then change a machine's state hold that machine's
+    lock, so updates for the same machine are serialised while updates for
+    different machines still run concurrently.
+    """
+
+    def __init__(self):
+        self.locks = {}
+
+    def __call__(self, machine_name):
+        lock = self.locks.get(machine_name)
+        if lock is None:
+            lock = self.locks[machine_name] = asyncio.Lock()
+        return lock
+
+    def __len__(self):
+        return len(self.locks)
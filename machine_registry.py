@@ -0,0 +1,80 @@
+import os
+import json
+from dataclasses import dataclass
+
+MACHINES_FILE = os.getenv('MACHINES_FILE', os.path.join(os.path.dirname(__file__), 'machines.json'))
+DEFAULT_DURATION = 2  # Minutes, for machine types without a configured duration
+
+@dataclass(frozen=True)
+class Machine:
+    id: str  # Stable identifier, used as the state key
+    token: str  # Short token used in callback data
+    name: str  # Display name shown to users
+    type: str  # e.g. 'washer' or 'dryer'
+    duration: int  # Default cycle length in minutes
+    floor: str
+    label: str  # Machine name in the Airtable log
+
+class MachineRegistry:
+    """All configured machines, in display order, indexed by ID, callback token and Airtable label."""
+
+    def __init__(self, machines):
+        self.machines = list(machines)
+        self.by_id = {}
+        self.by_token = {}
+        self.position_by_label = {}  # Airtable label -> display position, how analytics numbers machines
+        for position, machine in enumerate(self.machines):
+            for index, key, value in (
+                (self.by_id, machine.id, machine),
+                (self.by_token, machine.token, machine),
+                (self.position_by_label, machine.label, position)
+            ):
+                if key in index:
+                    raise ValueError(f"Duplicate machine key {key!r} in machine registry")
+                index[key] = value
+
+    def __iter__(self):
+        return iter(self.machines)
+
+    def __len__(self):
+        return len(self.machines)
+
+    def __contains__(self, machine_id):
+        return machine_id in self.by_id
+
+    def get(self, machine_id):
+        return self.by_id.get(machine_id)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a registry from a parsed machines config."""
+        types = config.get('types', {})
+        machines = []
+        for entry in config['machines']:
+            machine_type = entry['type']
+            duration = entry.get('duration', types.get(machine_type, {}).get('duration', DEFAULT_DURATION))
+            machines.append(Machine(
+                id=entry['id'],
+                token=entry.get('token', entry['id']),
+                name=entry.get('name', entry['id']),
+                type=machine_type,
+                duration=int(duration),
+                floor=entry.get('floor', ''),
+                label=entry.get('label', entry['id'])
+            ))
+        return cls(machines)
+
+    @classmethod
+    def load(cls, path=MACHINES_FILE):
+        """Load the registry from a JSON machines file."""
+        with open(path, encoding='utf-8') as f:
+            return cls.from_config(json.load(f))
+
+_registry = None
+
+def get_registry():
+    """Return the registry loaded from MACHINES_FILE, loading it on first use."""
+    global _registry
+    if _registry is None:
+        _registry = MachineRegistry.load()
+    return _registry
@@ -1,60 +1,127 @@
 import os
+import asyncio
 import logging
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
+    TypeHandler,
 )
+from airtable_logger import start_logging_worker, stop_logging_worker, register_machine_labels, spool, ADMIN_USERNAMES
+from state_store import create_store
+from shared_state import create_shared_state, new_worker_id, RedisSharedState
+from tenancy import load_tenants
+from telegram_sender import OutboundSender
+from status_dashboard import StatusDashboards
+from analytics import UsageAnalytics
+from webhook_server import start_monitoring_server, WEBHOOK_QUEUE_SIZE
+from metrics import register_application_gauges
+from sampling_profiler import SamplingProfiler
+from logging_setup import correlate_update
 from utils import (
     start, 
+    stats,
+    profile,
+    history,
+    rebuild,
     button_click_handler, 
-    get_status_modification_handler
+    restore_machines,
+    render_machine_statuses,
+    AUTHORIZED_USERS
 )
 
-def main():
-    # Configure logging
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
-    logger = logging.getLogger(__name__)
-
-    # Get the Telegram bot token from environment variables
-    TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+logger = logging.getLogger(__name__)
 
-    if not TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN is not set in environment variables.")
-        exit(1)
+async def post_init(application):
+    """Start background workers and restore persisted machine state."""
+    await start_logging_worker(application)
+    application.bot_data['sender'] = OutboundSender(application.bot)
+    application.bot_data['sender'].start()
+    for tenant in application.bot_data['tenants']:
+        tenant.scheduler.start()
+        tenant.auth.start()
+        tenant.analytics.start(tenant.scheduler)
+    await restore_machines(application)
+    register_application_gauges(application, spool)
+    if application.bot_data['mode'] != 'webhook' and isinstance(application.bot_data['shared'], RedisSharedState):
+        logger.warning("Polling with shared state: only one worker may poll, scale out in webhook mode.")
+    application.bot_data['monitoring_server'] = start_monitoring_server(application)
+    if PROFILER_ENABLED:
+        application.bot_data['profiler'].start()
 
-    logger.info("Starting the Telegram bot...")
+async def post_stop(application):
+    """Stop timers and flush queued messages while the bot can still send."""
+    for tenant in application.bot_data['tenants']:
+        await tenant.scheduler.stop()
+        await tenant.auth.stop()
+        tenant.analytics.stop()
+    await application.bot_data['sender'].stop()
+    application.bot_data['profiler'].stop()
+    if application.bot_data.get('monitoring_server'):
+        application.bot_data['monitoring_server'].stop()
 
-    """Start the bot."""
-    application = ApplicationBuilder().token(TOKEN).build()
+async def post_shutdown(application):
+    """Flush pending logs and close the machine stores."""
+    await stop_logging_worker(application)
+    application.bot_data['store'].close()
+    await application.bot_data['shared'].close()
 
-    # Initialize machines
-    application.bot_data['machines'] = {
-        'Ground Floor Washer 🌊': {'status': 'free'},
-        'Ground Floor Dryer ☀️': {'status': 'free'},
-        'Upper Floor Washer 1️⃣ 🌊': {'status': 'free'},
-        'Upper Floor Washer 2️⃣ 🌊': {'status': 'free'},
-        'Upper Floor Dryer 1️⃣ ☀️': {'status': 'free'},
-        'Upper Floor Dryer 2️⃣ ☀️': {'status': 'free'}
-    }
-
-    # Register handlers
-    application.add_handler(get_status_modification_handler())  # This should come first
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button_click_handler))
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # 'polling' or 'webhook'
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '').lower() in ('1', 'true', 'yes')  # Sample from startup
 
-    logger.info("Handlers added. Starting polling...")
+def build_application(token, mode=BOT_MODE, request=None, store=None, shared_state=None,
+                      authorized_users=AUTHORIZED_USERS, admin_users=ADMIN_USERNAMES):
+    """
+    Build the Application with its tenants and handlers.
 
-    try:
-        application.run_polling()
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        exit(1)
+    `request` replaces the HTTP client used for Bot API calls, e.g. with the
+    in-process fake used by benchmark.py. Applications given the same
+    `shared_state` behave as workers of one deployment.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        # Per-machine locks in utils keep concurrent updates consistent
+        .concurrent_updates(UPDATE_CONCURRENCY)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if mode == 'webhook':
+        # Updates arrive through the embedded server instead of the Updater
+        builder = (
+            builder
+            .updater(None)
+            .update_queue(asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+        )
+    application = builder.build()
 
-    logger.info("Polling has stopped. Exiting application.")
+    # Initialize tenants (TENANTS_FILE) and their machines (MACHINES_FILE)
+    store = store or create_store()
+    shared_state = shared_state or create_shared_state()
+    tenants = load_tenants(store, authorized_users=authorized_users, admin_users=admin_users)
+    for tenant in tenants:
+        tenant.shared = shared_state
+        tenant.dashboards = StatusDashboards(application, tenant, render_machine_statuses)
+        tenant.analytics = UsageAnalytics(tenant.id, tenant.registry)
+        register_machine_labels(machine.label for machine in tenant.registry)
+    application.bot_data['mode'] = mode
+    application.bot_data['store'] = store
+    application.bot_data['shared'] = shared_state
+    application.bot_data['worker_id'] = new_worker_id()
+    application.bot_data['tenants'] = tenants
+    application.bot_data['profiler'] = SamplingProfiler()
 
-if __name__ == '__main__':
-    main()
+    # Register handlers; group -1 tags every update's log records first
+    application.add_handler(TypeHandler(Update, correlate_update), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CommandHandler("history", history))
+    application.add_handler(CommandHandler("rebuild", rebuild))
+    application.add_handler(CallbackQueryHandler(button_click_handler))
+    return application
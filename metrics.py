@@ -0,0 +1,177 @@
+"""
+Latency histograms and gauges in the Prometheus text format.
+
+Handlers are timed with the `timed` decorator, outbound Telegram and
+Airtable calls with `observe`. Gauges (queue depths, scheduled jobs) are
+callbacks evaluated when /metrics is scraped, so they cost nothing between
+scrapes.
+"""
+import time
+import bisect
+import functools
+
+# Seconds; covers a cached render up to a slow Airtable batch
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, seconds, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = format_labels(self.label_names + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.series = {}
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Gauge:
+    """Samples read from a callback at scrape time; `metric_type` 'counter' for running totals."""
+
+    def __init__(self, name, help_text, label_names, collect, metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.collect = collect  # () -> iterable of (label values, value)
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in self.collect():
+            lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """Add a metric, replacing any earlier one of the same name."""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'washbot_handler_seconds', 'Time spent in update handlers and timer callbacks.', ('handler',)
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'washbot_handler_errors_total', 'Handler invocations that raised.', ('handler',)
+))
+TELEGRAM_LATENCY = REGISTRY.register(Histogram(
+    'washbot_telegram_request_seconds', 'Duration of outbound Telegram API calls.', ('method', 'outcome')
+))
+AIRTABLE_LATENCY = REGISTRY.register(Histogram(
+    'washbot_airtable_request_seconds', 'Duration of Airtable API calls.', ('operation', 'outcome')
+))
+
+def observe(histogram, started, *label_values):
+    """Record the time since `started` (a perf_counter value)."""
+    histogram.observe(time.perf_counter() - started, *label_values)
+
+def timed(func=None, *, name=None):
+    """Decorate a coroutine function to record its latency in HANDLER_LATENCY."""
+    if func is None:
+        return functools.partial(timed, name=name)
+    label = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            observe(HANDLER_LATENCY, started, label)
+    return wrapper
+
+def register_application_gauges(application, spool):
+    """Expose queue depths and scheduled job counts of a running application."""
+    def queues():
+        yield ('updates',), application.update_queue.qsize()
+        sender = application.bot_data.get('sender')
+        if sender:
+            yield ('telegram_outbound',), len(sender.pending)
+            yield ('telegram_outbound_background',), len(sender.background)
+        yield ('airtable_spool',), spool.pending_count()
+
+    def tenant_gauge(read):
+        def collect():
+            for tenant in application.bot_data['tenants']:
+                yield (tenant.id,), read(tenant)
+        return collect
+
+    REGISTRY.register(Gauge('washbot_queue_depth', 'Items waiting in internal queues.', ('queue',), queues))
+    REGISTRY.register(Gauge(
+        'washbot_scheduled_jobs', 'Pending timer entries per tenant.', ('tenant',),
+        tenant_gauge(lambda tenant: len(tenant.scheduler))
+    ))
+    REGISTRY.register(Gauge(
+        'washbot_waitlist_users', 'Users waiting for a machine per tenant.', ('tenant',),
+        tenant_gauge(lambda tenant: tenant.waiting)
+    ))
+    REGISTRY.register(Gauge(
+        'washbot_dashboards', 'Live status messages per tenant.', ('tenant',),
+        tenant_gauge(lambda tenant: len(tenant.dashboards) if tenant.dashboards else 0)
+    ))
+
+    def sender_counters():
+        sender = application.bot_data.get('sender')
+        if sender:
+            for key, value in sender.stats.items():
+                yield (key,), value
+    REGISTRY.register(Gauge(
+        'washbot_telegram_outbound_events_total', 'Outbound sender events since start.', ('event',),
+        sender_counters, metric_type='counter'
+    ))
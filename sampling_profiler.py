@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import threading
+import collections
+
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))  # Seconds between samples
+PROFILER_MAX_DEPTH = 64
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler for the event loop thread.
+
+    A daemon thread samples the target thread's stack every `interval`
+    seconds and counts identical stacks. Nothing is traced between
+    samples, so it can be left on in production while investigating.
+    Results are available as collapsed stacks (flamegraph.pl / speedscope
+    input) or as a top-N list of the functions seen most often.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()  # collapsed stack -> count
+        self.thread = None
+        self.target_id = None
+        self.stopping = threading.Event()
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, thread_id=None):
+        """Start sampling `thread_id` (default: the calling thread)."""
+        if self.running:
+            return
+        self.target_id = thread_id or threading.get_ident()
+        self.samples.clear()
+        self.stopping.clear()
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self.sample_loop, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling and return the number of seconds profiled."""
+        if not self.running:
+            return 0
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        return time.monotonic() - self.started_at
+
+    def sample_loop(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.target_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Return samples in collapsed-stack format, one 'frame;frame;... count' per line."""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+    def top(self, limit=10):
+        """Return [(function, share of samples)] for the innermost frames seen most often."""
+        leaves = collections.Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(frame, count / total) for frame, count in leaves.most_common(limit)]
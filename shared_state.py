@@ -0,0 +1,480 @@
+"""
+Machine state and expiry timers shared by every worker.
+
+Each tenant's machines live in one hash, together with a version counter
+bumped on every change and a sorted set of expiry timers (free_machine or
+claim expiry) keyed by machine. A transition is a compare-and-set on the
+machine's cycle generation that also replaces the machine's timer, so
+state and timer never disagree. A due timer is fired by whichever worker
+takes its lease first; a lease that is not completed, because its worker
+died, runs out after LEASE_TTL and the timer is taken over. The waitlists
+live there too, one queue per machine type, so whichever worker frees a
+machine hands it to the user who is really next in line.
+
+SHARED_STATE_URL selects a Redis server (redis://[:password@]host:port/db),
+spoken to directly over RESP. Without it, MemorySharedState keeps the same
+data in process: a single worker, or several Applications in one test.
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import secrets
+import urllib.parse
+from state_store import encode_info, decode_info
+from waitlist import Waitlist, WaitlistEntry
+
+SHARED_STATE_URL = os.getenv('SHARED_STATE_URL')
+SHARED_STATE_PREFIX = os.getenv('SHARED_STATE_PREFIX', 'washbot')
+SHARED_STATE_POOL_SIZE = int(os.getenv('SHARED_STATE_POOL_SIZE', '4'))
+LEASE_TTL = int(os.getenv('TIMER_LEASE_TTL', '30'))  # Seconds a worker may take to fire a timer
+CLAIM_EARLY = 1.0  # Seconds before its due time a timer may be claimed, for clock drift between workers
+
+class StateConflict(Exception):
+    """Another worker changed the machine since it was read."""
+
+def timer_for(machine_id, info):
+    """Return (due epoch seconds, payload) of the timer a machine state needs, or None."""
+    kind = {'occupied': 'free', 'reserved': 'claim'}.get(info.get('status'))
+    if kind is None or not info.get('end_time'):
+        return None
+    payload = {
+        'kind': kind,
+        'machine_id': machine_id,
+        'cycle': info['cycle'],
+        'user_id': info.get('user_id'),
+        'username': info.get('username'),
+    }
+    return info['end_time'].timestamp(), payload
+
+def new_worker_id():
+    """Lease owner name of this process; unique across restarts, readable in Redis."""
+    return f"{os.getenv('DYNO') or socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+def encode_payload(payload):
+    # Sorted, so equal payloads are equal strings for complete_timer
+    return json.dumps(payload, sort_keys=True)
+
+class SharedState:
+    """Interface of the shared backend; every method is a coroutine."""
+
+    async def machines(self, tenant_id):
+        """Return (version, {machine_id: info}) for every machine stored for a tenant."""
+        raise NotImplementedError
+
+    async def version(self, tenant_id):
+        """Return the tenant's version counter, bumped by every change."""
+        raise NotImplementedError
+
+    async def machine(self, tenant_id, machine_id):
+        """Return a machine's info, or None if it was never stored."""
+        raise NotImplementedError
+
+    async def compare_and_set(self, tenant_id, machine_id, expected_cycle, info):
+        """Store `info` and its timer if the stored cycle is still `expected_cycle`; returns whether it did."""
+        raise NotImplementedError
+
+    async def seed(self, tenant_id, machine_id, info):
+        """Store `info` and its timer unless the machine is already stored; returns whether it did."""
+        raise NotImplementedError
+
+    async def due_timers(self, tenant_id, before, limit=100):
+        """Return the names (machine IDs) of timers due at or before `before` (epoch seconds)."""
+        raise NotImplementedError
+
+    async def claim_timer(self, tenant_id, name, owner, ttl=LEASE_TTL):
+        """Lease a due timer to `owner` for `ttl` seconds; returns its payload, or None if it is not ours to fire."""
+        raise NotImplementedError
+
+    async def complete_timer(self, tenant_id, name, owner, payload):
+        """Drop a fired timer unless a transition replaced it meanwhile, and release the lease."""
+        raise NotImplementedError
+
+    async def waitlist_join(self, tenant_id, machine_type, user_id, username, priority=0):
+        """Queue a user for a machine type and return their position; joining twice keeps the first place."""
+        raise NotImplementedError
+
+    async def waitlist_requeue(self, tenant_id, machine_type, entry):
+        """Put back a popped WaitlistEntry in its original place."""
+        raise NotImplementedError
+
+    async def waitlist_leave(self, tenant_id, machine_type, user_id):
+        """Remove a user from a queue. Returns True if they were waiting."""
+        raise NotImplementedError
+
+    async def waitlist_position(self, tenant_id, machine_type, user_id):
+        """Return a user's 1-based place in the queue, or None."""
+        raise NotImplementedError
+
+    async def waitlist_waiting(self, tenant_id, machine_type):
+        """Return the number of users waiting for a machine type."""
+        raise NotImplementedError
+
+    async def waitlist_pop(self, tenant_id, machine_type):
+        """Remove and return the next WaitlistEntry for a machine type, or None."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class MemorySharedState(SharedState):
+    """In-process backend with the same semantics; every method completes without awaiting, so it is atomic."""
+
+    def __init__(self):
+        self.states = {}  # tenant_id -> {machine_id: encoded info}
+        self.versions = {}  # tenant_id -> int
+        self.timers = {}  # tenant_id -> {name: (due, encoded payload)}
+        self.leases = {}  # (tenant_id, name) -> (owner, expires)
+        self.waitlists = {}  # tenant_id -> Waitlist
+
+    async def machines(self, tenant_id):
+        states = self.states.get(tenant_id, {})
+        return self.versions.get(tenant_id, 0), {machine_id: decode_info(data) for machine_id, data in states.items()}
+
+    async def version(self, tenant_id):
+        return self.versions.get(tenant_id, 0)
+
+    async def machine(self, tenant_id, machine_id):
+        data = self.states.get(tenant_id, {}).get(machine_id)
+        return decode_info(data) if data is not None else None
+
+    def store(self, tenant_id, machine_id, info):
+        self.states.setdefault(tenant_id, {})[machine_id] = encode_info(info)
+        self.versions[tenant_id] = self.versions.get(tenant_id, 0) + 1
+        timers = self.timers.setdefault(tenant_id, {})
+        timer = timer_for(machine_id, info)
+        if timer is None:
+            timers.pop(machine_id, None)
+        else:
+            timers[machine_id] = (timer[0], encode_payload(timer[1]))
+
+    async def compare_and_set(self, tenant_id, machine_id, expected_cycle, info):
+        data = self.states.get(tenant_id, {}).get(machine_id)
+        cycle = json.loads(data).get('cycle', 0) if data is not None else 0
+        if cycle != expected_cycle:
+            return False
+        self.store(tenant_id, machine_id, info)
+        return True
+
+    async def seed(self, tenant_id, machine_id, info):
+        if machine_id in self.states.get(tenant_id, {}):
+            return False
+        self.store(tenant_id, machine_id, info)
+        return True
+
+    async def due_timers(self, tenant_id, before, limit=100):
+        timers = self.timers.get(tenant_id, {})
+        return sorted((name for name, (due, _) in timers.items() if due <= before), key=lambda name: timers[name][0])[:limit]
+
+    async def claim_timer(self, tenant_id, name, owner, ttl=LEASE_TTL):
+        now = time.time()
+        timer = self.timers.get(tenant_id, {}).get(name)
+        if timer is None or timer[0] > now + CLAIM_EARLY:
+            return None
+        lease = self.leases.get((tenant_id, name))
+        if lease is not None and lease[1] > now:
+            return None
+        self.leases[(tenant_id, name)] = (owner, now + ttl)
+        return json.loads(timer[1])
+
+    async def complete_timer(self, tenant_id, name, owner, payload):
+        lease = self.leases.get((tenant_id, name))
+        if lease is None or lease[0] != owner:
+            return
+        timers = self.timers.get(tenant_id, {})
+        if name in timers and timers[name][1] == encode_payload(payload):
+            del timers[name]
+        del self.leases[(tenant_id, name)]
+
+    def waitlist(self, tenant_id):
+        waitlist = self.waitlists.get(tenant_id)
+        if waitlist is None:
+            waitlist = self.waitlists[tenant_id] = Waitlist()
+        return waitlist
+
+    async def waitlist_join(self, tenant_id, machine_type, user_id, username, priority=0):
+        return self.waitlist(tenant_id).join(machine_type, user_id, username, priority)
+
+    async def waitlist_requeue(self, tenant_id, machine_type, entry):
+        self.waitlist(tenant_id).requeue(machine_type, entry)
+
+    async def waitlist_leave(self, tenant_id, machine_type, user_id):
+        return self.waitlist(tenant_id).leave(machine_type, user_id)
+
+    async def waitlist_position(self, tenant_id, machine_type, user_id):
+        return self.waitlist(tenant_id).position(machine_type, user_id)
+
+    async def waitlist_waiting(self, tenant_id, machine_type):
+        return self.waitlist(tenant_id).waiting(machine_type)
+
+    async def waitlist_pop(self, tenant_id, machine_type):
+        return self.waitlist(tenant_id).pop(machine_type)
+
+class RedisError(Exception):
+    """Error reply from the Redis server."""
+
+class RedisConnection:
+    """One RESP2 connection; requests are sent one at a time."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = urllib.parse.unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ssl = parsed.scheme == 'rediss'
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        if self.password:
+            await self.execute('AUTH', self.password)
+        if self.db:
+            await self.execute('SELECT', self.db)
+
+    async def execute(self, *args):
+        if self.writer is None:
+            await self.connect()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            self.writer.write(b''.join(parts))
+            await self.writer.drain()
+            return await self.read_reply()
+        except RedisError:
+            raise
+        except BaseException:
+            # Lost or cancelled mid-reply: the stream is out of step, reconnect on the next request
+            self.close()
+            raise
+
+    async def read_reply(self):
+        line = await self.reader.readuntil(b'\r\n')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2].decode()
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+# KEYS: machines hash, version, timers zset, timer payloads hash
+# ARGV: machine ID, expected cycle ('' to only set if absent), info, timer due ('' for none), timer payload
+STORE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if ARGV[2] == '' then
+    if current then return 0 end
+else
+    local cycle = 0
+    if current then cycle = cjson.decode(current)['cycle'] or 0 end
+    if tonumber(cycle) ~= tonumber(ARGV[2]) then return 0 end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+redis.call('INCR', KEYS[2])
+if ARGV[4] == '' then
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+else
+    redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+    redis.call('HSET', KEYS[4], ARGV[1], ARGV[5])
+end
+return 1
+"""
+
+# KEYS: timers zset, timer payloads hash, lease; ARGV: name, owner, ttl ms, now
+CLAIM_SCRIPT = """
+local due = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not due or tonumber(due) > tonumber(ARGV[4]) then return false end
+if not redis.call('SET', KEYS[3], ARGV[2], 'NX', 'PX', ARGV[3]) then return false end
+return redis.call('HGET', KEYS[2], ARGV[1])
+"""
+
+# KEYS: timers zset, timer payloads hash, lease; ARGV: name, owner, payload
+COMPLETE_SCRIPT = """
+if redis.call('GET', KEYS[3]) ~= ARGV[2] then return 0 end
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[3] then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+# Waitlist queues are sorted sets of user IDs scored by priority, then join order
+PRIORITY_SCALE = 2 ** 32
+
+# KEYS: waitlist zset, waitlist entries hash, join counter; ARGV: user ID, username, priority
+JOIN_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    local seq = redis.call('INCR', KEYS[3])
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[3]) * %d + seq, ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], cjson.encode({username = ARGV[2], priority = tonumber(ARGV[3]), seq = seq}))
+end
+return redis.call('ZRANK', KEYS[1], ARGV[1]) + 1
+""" % PRIORITY_SCALE
+
+# KEYS: waitlist zset, waitlist entries hash; ARGV: user ID, score, entry
+REQUEUE_SCRIPT = """
+if redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+end
+return 1
+"""
+
+# KEYS: waitlist zset, waitlist entries hash; ARGV: user ID
+LEAVE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return 0 end
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: waitlist zset, waitlist entries hash
+POP_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then return false end
+local entry = redis.call('HGET', KEYS[2], popped[1])
+redis.call('HDEL', KEYS[2], popped[1])
+return {popped[1], entry}
+"""
+
+class RedisSharedState(SharedState):
+    """
+    Backend on a Redis server, through a small pool of RESP connections.
+
+    Multi-key changes run as Lua scripts, so each is atomic on the server.
+    A tenant's keys share the {tenant} hash tag and thus one Redis Cluster slot.
+    """
+
+    def __init__(self, url=SHARED_STATE_URL, prefix=SHARED_STATE_PREFIX, pool_size=SHARED_STATE_POOL_SIZE):
+        self.prefix = prefix
+        self.pool = asyncio.Queue()
+        for _ in range(pool_size):
+            self.pool.put_nowait(RedisConnection(url))
+
+    def keys(self, tenant_id):
+        base = f"{self.prefix}:{{{tenant_id}}}"
+        return f"{base}:machines", f"{base}:version", f"{base}:timers", f"{base}:timer_payloads"
+
+    def lease_key(self, tenant_id, name):
+        return f"{self.prefix}:{{{tenant_id}}}:lease:{name}"
+
+    def waitlist_keys(self, tenant_id, machine_type):
+        base = f"{self.prefix}:{{{tenant_id}}}"
+        return f"{base}:waitlist:{machine_type}", f"{base}:waitlist_entries:{machine_type}"
+
+    async def execute(self, *args):
+        connection = await self.pool.get()
+        try:
+            return await connection.execute(*args)
+        finally:
+            self.pool.put_nowait(connection)
+
+    async def machines(self, tenant_id):
+        machines_key, version_key, _, _ = self.keys(tenant_id)
+        # One round trip would need MULTI on a dedicated connection; reading the version
+        # first means a change in between only makes the next sync reload again
+        version = int(await self.execute('GET', version_key) or 0)
+        fields = await self.execute('HGETALL', machines_key)
+        return version, {fields[i]: decode_info(fields[i + 1]) for i in range(0, len(fields), 2)}
+
+    async def version(self, tenant_id):
+        return int(await self.execute('GET', self.keys(tenant_id)[1]) or 0)
+
+    async def machine(self, tenant_id, machine_id):
+        data = await self.execute('HGET', self.keys(tenant_id)[0], machine_id)
+        return decode_info(data) if data is not None else None
+
+    async def store(self, tenant_id, machine_id, expected_cycle, info):
+        timer = timer_for(machine_id, info)
+        due, payload = (timer[0], encode_payload(timer[1])) if timer else ('', '')
+        stored = await self.execute(
+            'EVAL', STORE_SCRIPT, 4, *self.keys(tenant_id),
+            machine_id, expected_cycle, encode_info(info), due, payload
+        )
+        return stored == 1
+
+    async def compare_and_set(self, tenant_id, machine_id, expected_cycle, info):
+        return await self.store(tenant_id, machine_id, expected_cycle, info)
+
+    async def seed(self, tenant_id, machine_id, info):
+        return await self.store(tenant_id, machine_id, '', info)
+
+    async def due_timers(self, tenant_id, before, limit=100):
+        return await self.execute('ZRANGEBYSCORE', self.keys(tenant_id)[2], '-inf', before, 'LIMIT', 0, limit)
+
+    async def claim_timer(self, tenant_id, name, owner, ttl=LEASE_TTL):
+        _, _, timers_key, payloads_key = self.keys(tenant_id)
+        data = await self.execute(
+            'EVAL', CLAIM_SCRIPT, 3, timers_key, payloads_key, self.lease_key(tenant_id, name),
+            name, owner, int(ttl * 1000), time.time() + CLAIM_EARLY
+        )
+        return json.loads(data) if data else None
+
+    async def complete_timer(self, tenant_id, name, owner, payload):
+        _, _, timers_key, payloads_key = self.keys(tenant_id)
+        await self.execute(
+            'EVAL', COMPLETE_SCRIPT, 3, timers_key, payloads_key, self.lease_key(tenant_id, name),
+            name, owner, encode_payload(payload)
+        )
+
+    async def waitlist_join(self, tenant_id, machine_type, user_id, username, priority=0):
+        return await self.execute(
+            'EVAL', JOIN_SCRIPT, 3, *self.waitlist_keys(tenant_id, machine_type),
+            f"{self.prefix}:{{{tenant_id}}}:waitlist_seq", user_id, username or '', priority
+        )
+
+    async def waitlist_requeue(self, tenant_id, machine_type, entry):
+        data = json.dumps({'username': entry.username or '', 'priority': entry.priority, 'seq': entry.seq})
+        await self.execute(
+            'EVAL', REQUEUE_SCRIPT, 2, *self.waitlist_keys(tenant_id, machine_type),
+            entry.user_id, entry.priority * PRIORITY_SCALE + entry.seq, data
+        )
+
+    async def waitlist_leave(self, tenant_id, machine_type, user_id):
+        left = await self.execute('EVAL', LEAVE_SCRIPT, 2, *self.waitlist_keys(tenant_id, machine_type), user_id)
+        return left == 1
+
+    async def waitlist_position(self, tenant_id, machine_type, user_id):
+        rank = await self.execute('ZRANK', self.waitlist_keys(tenant_id, machine_type)[0], user_id)
+        return rank + 1 if rank is not None else None
+
+    async def waitlist_waiting(self, tenant_id, machine_type):
+        return await self.execute('ZCARD', self.waitlist_keys(tenant_id, machine_type)[0])
+
+    async def waitlist_pop(self, tenant_id, machine_type):
+        popped = await self.execute('EVAL', POP_SCRIPT, 2, *self.waitlist_keys(tenant_id, machine_type))
+        if not popped:
+            return None
+        user_id, data = popped
+        entry = json.loads(data)
+        return WaitlistEntry(int(user_id), entry['username'] or None, entry['priority'], entry['seq'])
+
+    async def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+def create_shared_state(url=SHARED_STATE_URL):
+    """Create the shared backend selected by SHARED_STATE_URL."""
+    if url:
+        return RedisSharedState(url)
+    return MemorySharedState()
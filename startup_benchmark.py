@@ -0,0 +1,78 @@
+"""
+Cold-start benchmark: time from process start to the first handled update.
+
+Usage:
+    python startup_benchmark.py [--runs 5] [--max-ms 1500]
+
+Each run is a fresh interpreter that boots the bot through bootstrap.py
+against the in-process Bot API fake (fakes.py), feeds it one /start update
+and reports the startup phases. Interpreter startup itself is not counted.
+Exits non-zero when the median time to the first update exceeds --max-ms.
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+TOKEN = '123456:BENCHMARK'
+
+async def cold_start():
+    """Boot once in this process and return the startup timer."""
+    import bootstrap
+    timer = bootstrap.StartupTimer(STARTED)
+    with timer.phase('fakes'):
+        from fakes import FakeBotRequest, running_application
+        from fake_telegram_client import make_command_update
+    application = bootstrap.bootstrap(TOKEN, timer, mode='webhook', request=FakeBotRequest())
+
+    from telegram import Update
+    async with running_application(application):
+        await application.update_queue.put(Update.de_json(make_command_update(10000), application.bot))
+        while timer.first_update is None:
+            await asyncio.sleep(0.001)
+    return timer
+
+def child():
+    timer = asyncio.run(cold_start())
+    print(json.dumps({'phases': timer.phases, 'first_update': timer.first_update}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=1500)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return 0
+
+    from fakes import scratch_env
+    env = scratch_env('washbot-startup-', dict(os.environ, LOG_LEVEL='WARNING'))
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child'], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print("Phase            median ms")
+    for index, (name, _) in enumerate(results[0]['phases']):
+        print(f"{name:<16} {statistics.median(result['phases'][index][1] for result in results) * 1000:>9.1f}")
+    first_update = statistics.median(result['first_update'] for result in results) * 1000
+    print(f"{'first update':<16} {first_update:>9.1f}  (max {max(r['first_update'] for r in results) * 1000:.1f})")
+
+    if first_update > args.max_ms:
+        print(f"FAIL: time to first update {first_update:.1f} ms exceeds the {args.max_ms} ms budget")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
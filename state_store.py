@@ -0,0 +1,120 @@
+import os
+import json
+import sqlite3
+import datetime
+import threading
+
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'events')  # 'events', 'sqlite' or 'memory'
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'machine_state.db')
+
+# Machine info fields holding datetimes
+TIME_FIELDS = ('start_time', 'end_time')
+
+def encode_info(info):
+    """Serialize a machine info dict to JSON."""
+    data = dict(info)
+    for field in TIME_FIELDS:
+        if isinstance(data.get(field), datetime.datetime):
+            data[field] = data[field].isoformat()
+    return json.dumps(data)
+
+def decode_info(text):
+    """Deserialize a machine info dict from JSON."""
+    data = json.loads(text)
+    for field in TIME_FIELDS:
+        if data.get(field):
+            data[field] = datetime.datetime.fromisoformat(data[field])
+    return data
+
+class MachineStore:
+    """
+    Persistence interface for machine state.
+
+    Only machines that are not free are stored, so loading on startup costs
+    O(active machines) regardless of how much history the bot has seen.
+    Stores that keep history set keeps_history and implement state_at and
+    stream.
+    """
+
+    keeps_history = False
+
+    def save(self, machine_name, info):
+        """Persist the state of one machine."""
+        raise NotImplementedError
+
+    def load_active(self):
+        """Return {machine_name: info} for every machine that is not free."""
+        raise NotImplementedError
+
+    def save_action(self, tenant_id, fields):
+        """Persist one logged action; stores without history drop it."""
+
+    def state_at(self, when):
+        """Return {machine_name: info} as it was at `when` (epoch seconds); needs keeps_history."""
+        raise NotImplementedError
+
+    def stream(self, kind, key=None):
+        """Yield logged events oldest first; needs keeps_history."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MemoryMachineStore(MachineStore):
+    """In-memory store, for tests."""
+
+    def __init__(self):
+        self.machines = {}
+
+    def save(self, machine_name, info):
+        if info.get('status') == 'free':
+            self.machines.pop(machine_name, None)
+        else:
+            self.machines[machine_name] = encode_info(info)
+
+    def load_active(self):
+        return {name: decode_info(text) for name, text in self.machines.items()}
+
+class SQLiteMachineStore(MachineStore):
+    """SQLite-backed store; each change is a single-row upsert or delete."""
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS machines (name TEXT PRIMARY KEY, info TEXT NOT NULL)"
+        )
+
+    def save(self, machine_name, info):
+        with self.lock:
+            if info.get('status') == 'free':
+                self.conn.execute("DELETE FROM machines WHERE name = ?", (machine_name,))
+            else:
+                self.conn.execute(
+                    "INSERT INTO machines (name, info) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET info = excluded.info",
+                    (machine_name, encode_info(info))
+                )
+
+    def load_active(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT name, info FROM machines").fetchall()
+        return {name: decode_info(text) for name, text in rows}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def create_store(backend=STATE_BACKEND):
+    """Create the machine store selected by STATE_BACKEND."""
+    if backend == 'memory':
+        return MemoryMachineStore()
+    if backend == 'sqlite':
+        return SQLiteMachineStore()
+    if backend == 'events':
+        # event_log builds on this module
+        from event_log import EventLogStore
+        return EventLogStore()
+    raise ValueError(f"Unknown state backend: {backend}")
@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+DASHBOARD_TICK = int(os.getenv('DASHBOARD_TICK', '60'))  # Seconds between updates
+DASHBOARD_IDLE_TTL = int(os.getenv('DASHBOARD_IDLE_TTL', str(15 * 60)))  # Seconds without interaction
+DASHBOARD_MAX = int(os.getenv('DASHBOARD_MAX_PER_TENANT', '50'))  # Live messages per tenant
+STATE_CHANGE_DELAY = 1  # Seconds to gather state changes into one update
+TICK_KEY = ('dashboard', 'tick')
+
+logger = logging.getLogger(__name__)
+
+class StatusDashboards:
+    """
+    Keep one tenant's status messages up to date in place.
+
+    Only the newest status message of each chat is live, until it has been
+    idle for DASHBOARD_IDLE_TTL, and at most DASHBOARD_MAX chats per tenant
+    are; beyond that the least recently used one stops updating. Each tick
+    renders the view once and edits only the live messages whose last sent
+    content differs from it, through the sender's background lane, so pushes
+    never delay replies. Ticks run on the expiry scheduler, and a state
+    change pulls the next tick forward.
+    """
+
+    def __init__(self, application, tenant, render):
+        self.application = application
+        self.tenant = tenant
+        self.render = render
+        self.subscriptions = OrderedDict()  # chat_id -> [message_id, expires_at, last_view], oldest use first
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def subscribe(self, chat_id, message_id, view):
+        """Register (or renew) a message that currently shows `view`; it replaces the chat's previous one."""
+        self.subscriptions[chat_id] = [message_id, time.monotonic() + DASHBOARD_IDLE_TTL, view]
+        self.subscriptions.move_to_end(chat_id)
+        while len(self.subscriptions) > DASHBOARD_MAX:
+            self.subscriptions.popitem(last=False)
+        scheduler = self.tenant.scheduler
+        if TICK_KEY not in scheduler:
+            scheduler.schedule(TICK_KEY, DASHBOARD_TICK, self.tick)
+
+    def unsubscribe(self, chat_id, message_id):
+        """Stop updating a message, e.g. because it now shows something else."""
+        subscription = self.subscriptions.get(chat_id)
+        if subscription and subscription[0] == message_id:
+            del self.subscriptions[chat_id]
+
+    def state_changed(self):
+        """Update subscribers shortly after a machine changes state."""
+        if not self.subscriptions:
+            return
+        scheduler = self.tenant.scheduler
+        remaining = scheduler.remaining(TICK_KEY)
+        if remaining is None or remaining > STATE_CHANGE_DELAY:
+            scheduler.schedule(TICK_KEY, STATE_CHANGE_DELAY, self.tick)
+
+    async def tick(self):
+        """Render once and push the view to every subscriber that is out of date."""
+        now = time.monotonic()
+        expired = [chat_id for chat_id, (_, expires_at, _) in self.subscriptions.items() if expires_at <= now]
+        for chat_id in expired:
+            del self.subscriptions[chat_id]
+        if not self.subscriptions:
+            return
+
+        view = self.render(self.tenant)
+        stale = [
+            (chat_id, subscription[0])
+            for chat_id, subscription in self.subscriptions.items() if subscription[2] != view
+        ]
+        for chat_id, _ in stale:
+            self.subscriptions[chat_id][2] = view
+
+        self.tenant.scheduler.schedule(TICK_KEY, DASHBOARD_TICK, self.tick)
+        if stale:
+            await asyncio.gather(*(self.push(key, view) for key in stale))
+
+    async def push(self, key, view):
+        status_message, _, reply_markup = view
+        chat_id, message_id = key
+        try:
+            await self.application.bot_data['sender'].edit_message_text(
+                chat_id,
+                message_id,
+                text=status_message,
+                reply_markup=reply_markup,
+                parse_mode="HTML",
+                background=True
+            )
+        except asyncio.QueueFull:
+            # The sender is backed up; retry on the next tick
+            subscription = self.subscriptions.get(chat_id)
+            if subscription and subscription[0] == message_id:
+                subscription[2] = None
+        except Exception as e:
+            # The message was most likely deleted; stop updating it
+            logger.info("Dropping dashboard %s in chat %s: %s", message_id, chat_id, e)
+            self.unsubscribe(chat_id, message_id)
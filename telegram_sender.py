@@ -0,0 +1,263 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from telegram.error import BadRequest, RetryAfter
+from metrics import TELEGRAM_LATENCY, observe
+
+GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Messages per second, all chats
+CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))  # Messages per second, per chat
+CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+MAX_IN_FLIGHT = int(os.getenv('TELEGRAM_MAX_IN_FLIGHT', '8'))
+BACKGROUND_RATE = float(os.getenv('TELEGRAM_BACKGROUND_RATE', '5'))  # Background messages per second, all chats
+BACKGROUND_QUEUE_SIZE = int(os.getenv('TELEGRAM_BACKGROUND_QUEUE_SIZE', '500'))  # Queued background requests
+IDLE_CHAT_BUCKETS = 10000  # Drop full per-chat buckets beyond this many
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available."""
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class OutboundRequest:
+    def __init__(self, method, chat_id, kwargs, future, background=False):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.background = background
+
+    def resolve(self, result=None, error=None):
+        """Complete the caller's future unless the caller already gave up."""
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+class OutboundSender:
+    """
+    Outbound queue for Telegram calls, with an interactive and a background lane.
+
+    Replies to users go to the interactive lane; work nobody is waiting on
+    (e.g. dashboard refreshes) is enqueued with background=True. Requests are
+    sent oldest first, interactive ones before any background one, subject to
+    a global and a per-chat token bucket. The background lane holds at most
+    BACKGROUND_QUEUE_SIZE requests; beyond that new background requests fail
+    with asyncio.QueueFull. A RetryAfter from Telegram pauses all sending for
+    the requested time and puts the request back at the front of its lane.
+    Queued edits of the same message are coalesced: only the newest text is
+    sent and the callers of superseded edits receive None. Background requests
+    also take a token from their own bucket (`background_rate`), so they never
+    use more than that share of the global rate.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 background_rate=BACKGROUND_RATE):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.background_bucket = TokenBucket(background_rate, background_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.pending = OrderedDict()  # key -> OutboundRequest, interactive lane
+        self.background = OrderedDict()  # key -> OutboundRequest, background lane
+        self.counter = itertools.count()
+        self.paused_until = 0
+        self.in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self.wakeup = None
+        self.task = None
+        self.sending = set()  # Tasks of requests being sent
+        self.stats = {
+            'sent': 0,
+            'coalesced': 0,
+            'background_rejected': 0,
+            'throttle_waits': 0,
+            'retry_after': 0,
+            'failed': 0,
+        }
+
+    def metrics(self):
+        """Return queue depth and throttling counters."""
+        return dict(
+            self.stats,
+            queue_depth=len(self.pending),
+            background_depth=len(self.background),
+            paused_for=max(self.paused_until - time.monotonic(), 0),
+        )
+
+    async def send_message(self, chat_id, background=False, **kwargs):
+        return await self.enqueue(next(self.counter), 'send_message', chat_id, kwargs, background)
+
+    async def edit_message_text(self, chat_id, message_id, background=False, **kwargs):
+        kwargs['message_id'] = message_id
+        return await self.enqueue(('edit', chat_id, message_id), 'edit_message_text', chat_id, kwargs, background)
+
+    async def delete_message(self, chat_id, message_id, background=False):
+        return await self.enqueue(next(self.counter), 'delete_message', chat_id, {'message_id': message_id}, background)
+
+    async def enqueue(self, key, method, chat_id, kwargs, background=False):
+        future = asyncio.get_running_loop().create_future()
+        if key in self.pending or not background:
+            # A queued interactive edit stays interactive when superseded
+            lane = self.pending
+            superseded = self.pending.get(key) or self.background.pop(key, None)
+            background = False
+        else:
+            lane = self.background
+            superseded = self.background.get(key)
+        if superseded:
+            # Keep the queue position, send only the newest content
+            superseded.resolve()
+            self.stats['coalesced'] += 1
+        elif background and len(lane) >= BACKGROUND_QUEUE_SIZE:
+            self.stats['background_rejected'] += 1
+            raise asyncio.QueueFull(f"{len(lane)} background requests queued")
+        lane[key] = OutboundRequest(method, chat_id, kwargs, future, background)
+        if self.wakeup:
+            self.wakeup.set()
+        return await future
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > IDLE_CHAT_BUCKETS:
+                # A full bucket behaves exactly like a new one, so it can go
+                now = time.monotonic()
+                for chat, idle in list(self.chat_buckets.items()):
+                    idle.refill(now)
+                    if idle.tokens >= idle.capacity:
+                        del self.chat_buckets[chat]
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def next_ready(self, now):
+        """
+        Return (lane, key, 0) for the request to send next, or (None, None,
+        seconds until one is ready): the oldest interactive request whose chat
+        has a token, else the oldest such background request if the
+        background bucket has a token too.
+        """
+        shortest_wait = None
+        for lane in (self.pending, self.background):
+            if lane is self.background and lane:
+                wait = self.background_bucket.wait_time(now)
+                if wait > 0:
+                    return None, None, wait if shortest_wait is None else min(shortest_wait, wait)
+            for key, request in lane.items():
+                wait = self.chat_bucket(request.chat_id).wait_time(now)
+                if wait == 0:
+                    return lane, key, 0
+                shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+        return None, None, shortest_wait
+
+    async def run(self):
+        while True:
+            if not self.pending and not self.background:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            wait = max(self.paused_until - now, self.global_bucket.wait_time(now))
+            key = None
+            if wait <= 0:
+                lane, key, wait = self.next_ready(now)
+
+            if key is None:
+                self.stats['throttle_waits'] += 1
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            request = lane.pop(key)
+            self.global_bucket.take()
+            if request.background:
+                self.background_bucket.take()
+            self.chat_bucket(request.chat_id).take()
+            await self.in_flight.acquire()
+            task = asyncio.create_task(self.execute(key, request))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def execute(self, key, request):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await getattr(self.bot, request.method)(chat_id=request.chat_id, **request.kwargs)
+            outcome = 'ok'
+            self.stats['sent'] += 1
+            request.resolve(result)
+        except RetryAfter as e:
+            outcome = 'retry_after'
+            self.stats['retry_after'] += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+            logger.warning("Telegram asked to retry after %ss, pausing outbound queue.", e.retry_after)
+            lane = self.background if request.background else self.pending
+            if key not in self.pending and key not in self.background:
+                lane[key] = request
+                lane.move_to_end(key, last=False)
+            else:
+                request.resolve()
+            self.wakeup.set()
+        except BadRequest as e:
+            if "Message is not modified" in str(e):
+                outcome = 'not_modified'
+                request.resolve()
+            else:
+                self.stats['failed'] += 1
+                request.resolve(error=e)
+        except Exception as e:
+            self.stats['failed'] += 1
+            request.resolve(error=e)
+        finally:
+            observe(TELEGRAM_LATENCY, started, request.method, outcome)
+            self.in_flight.release()
+
+    def start(self):
+        """Start the sender task on the running event loop."""
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout=10):
+        """Send what is queued (up to `timeout` seconds), then stop."""
+        if self.task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.pending or self.background) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        if self.sending:
+            await asyncio.wait(set(self.sending), timeout=max(deadline - time.monotonic(), 0))
+        for lane in (self.pending, self.background):
+            for request in lane.values():
+                request.future.cancel()
+            lane.clear()
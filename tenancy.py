@@ -0,0 +1,119 @@
+import os
+import json
+from machine_registry import MachineRegistry, get_registry
+from machine_locks import MachineLocks
+from expiry_scheduler import ExpiryScheduler
+from authorization import Authorization, DenialLog, entries_from_usernames, AUTH_FILE
+
+TENANTS_FILE = os.getenv('TENANTS_FILE')  # Optional; without it the bot serves one building
+DEFAULT_TENANT_ID = 'default'
+
+class Tenant:
+    """
+    One building or laundry room.
+
+    A tenant owns its machines and their state, the authorization service
+    for its users, its Airtable table, and its own scheduler, locks,
+    waitlist and render cache, so activity in one building never queues
+    behind another.
+    """
+
+    def __init__(self, tenant_id, registry, auth, airtable_table=None, store=None):
+        self.id = tenant_id
+        self.registry = registry
+        self.auth = auth
+        self.airtable_table = airtable_table
+        self.store = store
+        self.machines = {machine.id: {'status': 'free'} for machine in registry}
+        self.scheduler = ExpiryScheduler()
+        self.locks = MachineLocks()
+        self.waiting = 0  # Users in the shared waitlists, as of the last timer poll
+        self.state_version = 0
+        self.render_cache = {}
+        self.dashboards = None
+        self.analytics = None
+        self.shared = None  # SharedState, set by build_application
+        self.shared_version = 0  # Version of the shared state last loaded
+
+    def __repr__(self):
+        return f"Tenant({self.id!r}, {len(self.registry)} machines)"
+
+    def state_key(self, machine_id):
+        """Key under which a machine's state is persisted."""
+        return f"{self.id}/{machine_id}"
+
+class TenantDirectory:
+    """Tenants with O(1) lookup by chat ID, user ID or username."""
+
+    def __init__(self, tenants, default_tenant_id=None):
+        self.tenants = {tenant.id: tenant for tenant in tenants}
+        self.default = self.tenants.get(default_tenant_id)
+        self.by_chat = {}
+        self.by_user = {}
+        self.denials = DenialLog()  # Rate limits "no tenant" warnings
+
+    def __iter__(self):
+        return iter(self.tenants.values())
+
+    def __len__(self):
+        return len(self.tenants)
+
+    def get(self, tenant_id):
+        return self.tenants.get(tenant_id)
+
+    def assign_chat(self, chat_id, tenant):
+        self.by_chat[chat_id] = tenant
+
+    def assign_user(self, user_key, tenant):
+        """Map a user ID or username to a tenant."""
+        self.by_user[user_key] = tenant
+
+    def resolve(self, chat_id, user):
+        """Return the tenant for an update, falling back to the default tenant."""
+        tenant = self.by_chat.get(chat_id)
+        if tenant is None and user is not None:
+            tenant = self.by_user.get(user.id) or self.by_user.get(user.username)
+        return tenant or self.default
+
+def load_tenants(store=None, path=TENANTS_FILE, authorized_users=(), admin_users=()):
+    """
+    Build the tenant directory from TENANTS_FILE.
+
+    Without a tenants file a single default tenant serves every chat, using
+    the machine registry from MACHINES_FILE, the given user and admin
+    usernames and the access file AUTH_FILE.
+    """
+    if not path:
+        auth = Authorization(entries_from_usernames(authorized_users, admin_users), AUTH_FILE)
+        tenant = Tenant(DEFAULT_TENANT_ID, get_registry(), auth, store=store)
+        return TenantDirectory([tenant], DEFAULT_TENANT_ID)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    tenants = []
+    for entry in config['tenants']:
+        machines_file = os.path.join(base_dir, entry['machines_file'])
+        auth_file = entry.get('auth_file') and os.path.join(base_dir, entry['auth_file'])
+        auth = Authorization(
+            entries_from_usernames(entry.get('authorized_users', []), entry.get('admin_users', [])),
+            auth_file
+        )
+        tenants.append(Tenant(
+            entry['id'],
+            MachineRegistry.load(machines_file),
+            auth,
+            airtable_table=entry.get('airtable_table'),
+            store=store
+        ))
+
+    directory = TenantDirectory(tenants, config.get('default'))
+    for entry in config['tenants']:
+        tenant = directory.get(entry['id'])
+        for chat_id in entry.get('chats', []):
+            directory.assign_chat(chat_id, tenant)
+        # Every authorized user is routed to this tenant in private chats
+        for user_key in entry.get('users', []) + entry.get('authorized_users', []):
+            directory.assign_user(user_key, tenant)
+    return directory
@@ -1,58 +1,276 @@
 import os
+import html
+import time
 import logging
 import datetime
-from dotenv import load_dotenv
+import functools
+import contextlib
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
-from telegram.ext import (
-    ContextTypes,
-    ConversationHandler,
-    CallbackQueryHandler,
-)
-import asyncio
-from airtable_logger import log_action
-import telegram
-
-# Load environment variables
-load_dotenv()
+from telegram.ext import ContextTypes
+from airtable_logger import log_action, NO_MACHINE
+import callback_codec
+from authorization import ADMIN
+from analytics import format_stats, DEFAULT_WINDOW_DAYS
+from waitlist import CLAIM_TIMEOUT, predict_free_times
+from metrics import timed
+from logging_setup import bind
+from event_log import replay_actions
+from shared_state import StateConflict
 
 # Constants
-AUTHORIZED_USERS = os.getenv('AUTHORIZED_USERS', '').split(',')
-SELECTING_MACHINE = 1
-SELECTING_STATUS = 2
-ENTERING_TIME = 3
-MACHINE_MAP = {
-    'Ground Floor Washer 🌊': 'Ground Floor Wash',
-    'Ground Floor Dryer ☀️': 'Ground Floor Dry',
-    'Upper Floor Washer 1️⃣ 🌊': 'Floor 1 Wash 1',
-    'Upper Floor Washer 2️⃣ 🌊': 'Floor 1 Wash 2',
-    'Upper Floor Dryer 1️⃣ ☀️': 'Floor 1 Dry 1',
-    'Upper Floor Dryer 2️⃣ ☀️': 'Floor 1 Dry 2',
-    'None': 'None'
-}
+AUTHORIZED_USERS = frozenset(filter(None, os.getenv('AUTHORIZED_USERS', '').split(',')))
+NOTIFICATION_TTL = 24 * 60 * 60  # Seconds before a cycle-complete message is deleted
+TIMER_POLL_INTERVAL = int(os.getenv('TIMER_POLL_INTERVAL', '5'))  # Seconds between shared timer polls
+TIMER_TAKEOVER_GRACE = int(os.getenv('TIMER_TAKEOVER_GRACE', '10'))  # Seconds overdue before another worker fires a timer
+POLL_KEY = ('shared', 'poll')
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+async def update_machine(tenant, machine_id, info):
+    """
+    Set a machine's state and persist the change.
+
+    Every change bumps the machine's cycle generation, so scheduled entries
+    created for an earlier state can recognise that they are stale. The
+    shared state is only changed if no other worker changed the machine since
+    it was read; otherwise StateConflict is raised and nothing changes.
+    """
+    previous = tenant.machines.get(machine_id, {})
+    info['cycle'] = previous.get('cycle', 0) + 1
+    if not await tenant.shared.compare_and_set(tenant.id, machine_id, previous.get('cycle', 0), info):
+        raise StateConflict(f"{tenant.state_key(machine_id)} changed since cycle {previous.get('cycle', 0)}")
+    apply_machine(tenant, machine_id, info)
+    if tenant.store:
+        tenant.store.save(tenant.state_key(machine_id), info)
+
+def apply_machine(tenant, machine_id, info):
+    """Replace the local copy of a machine's state."""
+    tenant.machines[machine_id] = info
+    tenant.state_version += 1
+    if tenant.dashboards:
+        tenant.dashboards.state_changed()
+
+async def sync_machines(tenant):
+    """Pick up changes other workers made to the tenant's machines; one round trip if there are none."""
+    if await tenant.shared.version(tenant.id) == tenant.shared_version:
+        return
+    tenant.shared_version, machines = await tenant.shared.machines(tenant.id)
+    for machine_id, info in machines.items():
+        local = tenant.machines.get(machine_id)
+        # Only newer: a slower read must not undo a change this worker already made
+        if local is not None and info.get('cycle', 0) > local.get('cycle', 0):
+            apply_machine(tenant, machine_id, info)
+
+def record_action(tenant, user_id, username, action, machine=NO_MACHINE, duration=None):
+    """Log an action to the event log, the tenant's Airtable table and its local analytics."""
+    is_admin = tenant.auth.lookup(user_id, username) == ADMIN
+    if tenant.store:
+        tenant.store.save_action(tenant.id, {
+            'action': action,
+            'machine': machine,
+            'duration': duration,
+            'user_id': user_id,
+            'username': username,
+            'is_admin': is_admin,
+        })
+    log_action(username, action, machine, duration, table_name=tenant.airtable_table, is_admin=is_admin)
+    if tenant.analytics is not None:
+        tenant.analytics.record(action, machine, duration, user_id)
+
+@contextlib.asynccontextmanager
+async def machine_lock(tenant, machine_id):
+    """
+    Hold the lock guarding a machine's state transitions.
+
+    The lock serialises this worker's handlers; on entry the machine is
+    re-read from the shared state, so decisions use what other workers
+    wrote, and update_machine's compare-and-set catches the rest.
+    """
+    async with tenant.locks(machine_id):
+        info = await tenant.shared.machine(tenant.id, machine_id)
+        if info is not None and info.get('cycle', 0) > tenant.machines.get(machine_id, {}).get('cycle', 0):
+            apply_machine(tenant, machine_id, info)
+        yield
+
+def schedule_expiry(application, tenant, machine_id, info):
+    """
+    Fire the machine's shared timer from this worker at its end_time.
+
+    The timer itself was stored by update_machine; whichever worker leases
+    it first runs free_machine or expire_claim, and poll_timers on any
+    worker takes over timers left overdue by a worker that is gone.
+    """
+    delay = (info['end_time'] - datetime.datetime.now()).total_seconds()
+    tenant.scheduler.schedule(('free', machine_id), delay, fire_timer, application, tenant, machine_id)
+
+def cancel_expiry(tenant, machine_id):
+    """Cancel this worker's pending free_machine or claim expiry entry for a machine."""
+    tenant.scheduler.cancel(('free', machine_id))
+
+async def fire_timer(application, tenant, machine_id):
+    """
+    Run a machine's due timer if this worker wins its lease.
+
+    The timer is completed once the callback ran or lost to a concurrent
+    change. On any other error it is left in place with its lease, so once
+    the lease runs out (TIMER_LEASE_TTL) poll_timers on some worker retries it.
+    """
+    shared = tenant.shared
+    worker_id = application.bot_data['worker_id']
+    job_data = await shared.claim_timer(tenant.id, machine_id, worker_id)
+    if job_data is None:
+        return
+    try:
+        callback = free_machine if job_data['kind'] == 'free' else expire_claim
+        await callback(application, tenant, job_data)
+    except StateConflict as e:
+        logger.info("Timer for %s lost to a concurrent change: %s", machine_id, e)
+    await shared.complete_timer(tenant.id, machine_id, worker_id, job_data)
+
+async def poll_timers(application, tenant):
+    """Take over overdue timers and pick up other workers' changes, every TIMER_POLL_INTERVAL."""
+    try:
+        await sync_machines(tenant)
+        tenant.waiting = sum([
+            await tenant.shared.waitlist_waiting(tenant.id, machine_type)
+            for machine_type in {machine.type for machine in tenant.registry}
+        ])
+        overdue = await tenant.shared.due_timers(tenant.id, time.time() - TIMER_TAKEOVER_GRACE)
+        for machine_id in overdue:
+            if machine_id in tenant.machines:
+                logger.info("Taking over the overdue timer of %s.", tenant.state_key(machine_id))
+                tenant.scheduler.schedule(('free', machine_id), 0, fire_timer, application, tenant, machine_id)
+    except Exception as e:
+        logger.error("Failed to poll shared timers for %s: %s", tenant.id, e)
+    tenant.scheduler.schedule(POLL_KEY, TIMER_POLL_INTERVAL, poll_timers, application, tenant)
+
+async def release_machine(application, tenant, machine):
+    """
+    Free a machine, or reserve it for the next user waiting for its type.
+
+    Must be called while holding the machine's lock. Returns the waitlist
+    entry the machine was handed to, or None if it is now free.
+    """
+    entry = await tenant.shared.waitlist_pop(tenant.id, machine.type)
+    if entry is None:
+        await update_machine(tenant, machine.id, {'status': 'free'})
+        return None
+
+    info = {
+        'status': 'reserved',
+        'user_id': entry.user_id,
+        'username': entry.username,
+        'end_time': datetime.datetime.now() + datetime.timedelta(seconds=CLAIM_TIMEOUT)
+    }
+    try:
+        await update_machine(tenant, machine.id, info)
+    except Exception:
+        # Still first in line for the next one
+        await tenant.shared.waitlist_requeue(tenant.id, machine.type, entry)
+        raise
+    schedule_expiry(application, tenant, machine.id, info)
+    logger.info("Reserved %s for @%s.", machine.name, entry.username)
+    return entry
+
+async def notify_claim(application, tenant, machine, entry):
+    """Tell a waiting user that a machine is theirs to start."""
+    keyboard = [[InlineKeyboardButton(
+        f"▶️ Start {machine.name}", callback_data=callback_codec.encode(callback_codec.START_MACHINE, machine.token)
+    )]]
+    try:
+        await application.bot_data['sender'].send_message(
+            entry.user_id,
+            text=(
+                f"🔔 <b>{machine.name}</b> is free and reserved for you.\n"
+                f"Start it within <b>{CLAIM_TIMEOUT // 60} minutes</b> or it goes to the next person waiting."
+            ),
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error("Failed to notify @%s of their reservation: %s", entry.username, e)
+
+def predicted_wait(tenant, machine_type, position, now=None):
+    """Return the predicted minutes until the `position`-th next machine of a type is available, or None."""
+    now = now or datetime.datetime.now()
+    end_times = []
+    duration = None
+    for machine in tenant.registry:
+        if machine.type != machine_type:
+            continue
+        duration = datetime.timedelta(minutes=machine.duration)
+        info = tenant.machines.get(machine.id, {})
+        status = info.get('status')
+        if status == 'free':
+            end_times.append(now)
+        elif status in ('occupied', 'reserved'):
+            end_times.append(max(info.get('end_time') or now, now))
+    predicted = predict_free_times(end_times, duration, position)
+    if len(predicted) < position:
+        return None
+    return remaining_minutes({'end_time': predicted[-1]}, now)
+
+async def restore_machines(application):
+    """
+    Restore machine state and schedule pending timers on this worker.
+
+    Machines the shared state does not know yet are seeded from the local
+    store; for the rest the shared state wins, since other workers may have
+    changed them while this one was down.
+    """
+    tenants = application.bot_data['tenants']
+    store = application.bot_data.get('store')
+    for key, info in (store.load_active() if store else {}).items():
+        tenant_id, _, machine_id = key.partition('/')
+        tenant = tenants.get(tenant_id)
+        if not tenant or machine_id not in tenant.machines:
+            continue
+        info.setdefault('cycle', 1)
+        if info.get('status') in ('occupied', 'reserved'):
+            # A reservation restored from the local store just runs out if the shared waitlist was lost
+            info.setdefault('end_time', datetime.datetime.now())
+        if await tenant.shared.seed(tenant.id, machine_id, info):
+            logger.info("Restored %s as %s.", key, info.get('status'))
+
+    for tenant in tenants:
+        await sync_machines(tenant)
+        for machine_id, info in tenant.machines.items():
+            if info.get('status') in ('occupied', 'reserved') and info.get('end_time'):
+                schedule_expiry(application, tenant, machine_id, info)
+        tenant.scheduler.schedule(POLL_KEY, TIMER_POLL_INTERVAL, poll_timers, application, tenant)
+
+def resolve_tenant(context, chat_id, user, where):
+    """Return the tenant an update belongs to, or None if the user may not use it."""
+    tenants = context.bot_data['tenants']
+    tenant = tenants.resolve(chat_id, user)
+    if tenant is None:
+        if tenants.denials.should_log(user.id):
+            logger.warning("No tenant for %s by @%s in chat %s.", where, user.username, chat_id)
+        return None
+    if not tenant.auth.is_authorized(user):
+        tenant.auth.log_denial(user, where)
+        return None
+    return tenant
+
+@timed
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /start command."""
     user = update.effective_user
     username = user.username
+    tenant = resolve_tenant(context, update.effective_chat.id, user, "access attempt")
 
-    if username not in AUTHORIZED_USERS:
-        await update.message.reply_text("❌ <b>Access Denied.</b>", parse_mode="HTML")
-        logger.warning(f"Unauthorized access attempt by @{username}.")
+    if tenant is None:
+        await context.bot_data['sender'].send_message(
+            update.effective_chat.id, text="❌ <b>Access Denied.</b>", parse_mode="HTML"
+        )
         return
 
     keyboard = [
-        [InlineKeyboardButton("📊 Show Machine Statuses", callback_data='show_status')]
+        [InlineKeyboardButton("📊 Show Machine Statuses", callback_data=callback_codec.encode(callback_codec.SHOW_STATUS))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -61,117 +279,410 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Please choose an option below to manage the machines."
     )
 
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode="HTML")
+    await context.bot_data['sender'].send_message(
+        update.effective_chat.id, text=welcome_message, reply_markup=reply_markup, parse_mode="HTML"
+    )
+
+@timed
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the admin /stats [days] command."""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    tenant = resolve_tenant(context, chat_id, user, "stats request")
+
+    if tenant is None or not tenant.auth.is_admin(user):
+        await context.bot_data['sender'].send_message(
+            chat_id, text="❌ <b>Access Denied.</b>", parse_mode="HTML"
+        )
+        return
+
+    try:
+        days = int(context.args[0]) if context.args else DEFAULT_WINDOW_DAYS
+    except ValueError:
+        days = 0
+    if days <= 0:
+        await context.bot_data['sender'].send_message(chat_id, text="Usage: /stats [days]")
+        return
+
+    usage = tenant.analytics.stats(days)
+    await context.bot_data['sender'].send_message(
+        chat_id, text=format_stats(usage, tenant.registry), parse_mode="HTML"
+    )
+
+@timed
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the admin /profile command: toggle the sampling profiler and report its hottest frames."""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    tenant = resolve_tenant(context, chat_id, user, "profile request")
+    sender = context.bot_data['sender']
+
+    if tenant is None or not tenant.auth.is_admin(user):
+        await sender.send_message(chat_id, text="❌ <b>Access Denied.</b>", parse_mode="HTML")
+        return
+
+    profiler = context.bot_data['profiler']
+    if not profiler.running:
+        profiler.start()
+        logger.info("Sampling profiler started by @%s.", user.username)
+        await sender.send_message(chat_id, text="🔬 Profiler started. Send /profile again to stop it.")
+        return
+
+    seconds = profiler.stop()
+    logger.info("Sampling profiler stopped by @%s after %.0fs.", user.username, seconds)
+    lines = [f"🔬 <b>Profile of {seconds:.0f}s, {sum(profiler.samples.values())} samples</b>"]
+    lines += [f"{share:5.1%} {html.escape(frame)}" for frame, share in profiler.top()]
+    await sender.send_message(chat_id, text="\n".join(lines), parse_mode="HTML")
+
+def parse_past_time(text, now=None):
+    """Parse '90m', '3h', '2d' (that long ago) or an ISO date and time; returns a datetime or None."""
+    now = now or datetime.datetime.now()
+    units = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+    try:
+        if text[-1:] in units and text[:-1].isdigit():
+            return now - datetime.timedelta(**{units[text[-1]]: int(text[:-1])})
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+def render_past_statuses(tenant, infos, when):
+    """Return the status view of `infos` ({machine_id: info}) as it was at `when`."""
+    lines = [f"🕰 <b>Machine Statuses at {when:%Y-%m-%d %H:%M}:</b>\n"]
+    for machine in tenant.registry:
+        info = infos.get(machine.id, {'status': 'free'})
+        status = info.get('status')
+        if status == 'occupied':
+            lines.append(
+                f"⏳ <b>{machine.name}</b>: Occupied by @{html.escape(info.get('username') or '?')}"
+                f" ({remaining_minutes(info, when)} min left)"
+            )
+        elif status == 'reserved':
+            lines.append(f"🔒 <b>{machine.name}</b>: Reserved for @{html.escape(info.get('username') or '?')}")
+        elif status == 'broken':
+            lines.append(f"❌ <b>{machine.name}</b>: Broken")
+        else:
+            lines.append(f"✅ <b>{machine.name}</b>: Free")
+    return "\n".join(lines)
+
+@timed
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the admin /history <when> command: show the statuses at a past time, folded from the event log."""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    tenant = resolve_tenant(context, chat_id, user, "history request")
+    sender = context.bot_data['sender']
+
+    if tenant is None or not tenant.auth.is_admin(user):
+        await sender.send_message(chat_id, text="❌ <b>Access Denied.</b>", parse_mode="HTML")
+        return
+
+    when = parse_past_time(" ".join(context.args)) if context.args else None
+    if when is None:
+        await sender.send_message(chat_id, text="Usage: /history <90m | 3h | 2d | YYYY-MM-DD HH:MM>")
+        return
+
+    if not tenant.store.keeps_history:
+        await sender.send_message(chat_id, text="⚠️ This state backend keeps no history.")
+        return
+    state = tenant.store.state_at(when.timestamp())
+    prefix = tenant.state_key('')
+    infos = {key[len(prefix):]: info for key, info in state.items() if key.startswith(prefix)}
+    await sender.send_message(chat_id, text=render_past_statuses(tenant, infos, when), parse_mode="HTML")
+
+@timed
+async def rebuild(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the admin /rebuild analytics | airtable <table> command: rebuild a derived view from the event log."""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    tenant = resolve_tenant(context, chat_id, user, "rebuild request")
+    sender = context.bot_data['sender']
+
+    if tenant is None or not tenant.auth.is_admin(user):
+        await sender.send_message(chat_id, text="❌ <b>Access Denied.</b>", parse_mode="HTML")
+        return
+
+    args = context.args or []
+    if args == ['analytics']:
+        # The log only has actions since it was introduced; older ones stay as archived
+        usage = tenant.analytics
+        since = []
+
+        def sink(when, fields):
+            when = datetime.datetime.fromtimestamp(when)
+            if not since:
+                usage.truncate(when)
+                since.append(when)
+            usage.record(fields['action'], fields['machine'], fields['duration'], fields['user_id'], when)
+        target = "analytics"
+    elif len(args) == 2 and args[0] == 'airtable':
+        # Into a separate table; the live table already has these records
+        table_name = args[1]
+
+        def sink(when, fields):
+            log_action(
+                fields['username'], fields['action'], fields['machine'], fields['duration'],
+                table_name=table_name, is_admin=fields['is_admin'], timestamp=datetime.datetime.fromtimestamp(when)
+            )
+        target = f"Airtable table {html.escape(table_name)}"
+    else:
+        await sender.send_message(chat_id, text="Usage: /rebuild analytics | /rebuild airtable <table>")
+        return
+
+    if not tenant.store.keeps_history:
+        await sender.send_message(chat_id, text="⚠️ This state backend keeps no history.")
+        return
+    count = await replay_actions(tenant.store, tenant.id, [sink])
+    logger.info("Rebuilt %s from %s logged actions for @%s.", target, count, user.username)
+    text = f"🔁 Rebuilt {target} from <b>{count}</b> logged actions."
+    if args == ['analytics'] and since:
+        text += f"\nEvents before {since[0]:%Y-%m-%d %H:%M} were kept from the archive."
+    await sender.send_message(chat_id, text=text, parse_mode="HTML")
+
+async def edit_query_message(context, tenant, query, text, **kwargs):
+    """Edit the message a pressed button belongs to, via the outbound sender."""
+    # The message no longer shows statuses, so live updates must stop
+    if tenant:
+        tenant.dashboards.unsubscribe(query.message.chat_id, query.message.message_id)
+    await context.bot_data['sender'].edit_message_text(
+        query.message.chat_id,
+        query.message.message_id,
+        text=text,
+        **kwargs
+    )
+
+def remaining_minutes(info, now=None):
+    """Return the whole minutes left on an occupied machine."""
+    end_time = info.get('end_time')
+    if not end_time:
+        return 0
+    now = now or datetime.datetime.now()
+    return max(int((end_time - now).total_seconds() / 60), 0)
+
+def render_machine_statuses(tenant):
+    """
+    Return (html_text, plain_text, reply_markup) for the status view.
+
+    The view is cached on the state version plus the remaining minutes of
+    occupied machines, and the keyboard only on the set of free machines, so
+    repeated renders of an unchanged state cost one tuple comparison.
+    """
+    registry = tenant.registry
+    machines = tenant.machines
+    now = datetime.datetime.now()
+    remaining = tuple(
+        remaining_minutes(info, now) for info in machines.values() if info.get('status') in ('occupied', 'reserved')
+    )
+    key = (tenant.state_version, remaining)
+    cache = tenant.render_cache
+    if cache.get('key') == key:
+        return cache['view']
 
-async def show_machine_statuses(chat_id, context: ContextTypes.DEFAULT_TYPE, message=None):
-    """Display the current machine statuses with improved UI."""
-    machines = context.bot_data.get('machines', {})
     status_lines = []
-    keyboard = []
+    free_machines = []
 
-    for machine, info in machines.items():
+    for machine in registry:
+        info = machines.get(machine.id, {})
         status = info.get('status', 'unknown').lower()
         if status == 'free':
-            status_lines.append(f"✅ <b>{machine}</b>: Free")
-            keyboard.append([InlineKeyboardButton(f"▶️ Start {machine}", callback_data=f"start_{machine}")])
+            status_lines.append(f"✅ <b>{machine.name}</b>: Free")
+            free_machines.append(machine)
         elif status == 'occupied':
-            end_time = info.get('end_time')
-            remaining = (end_time - datetime.datetime.now()).total_seconds() / 60 if end_time else 0
-            remaining = max(int(remaining), 0)
-            status_lines.append(f"⏳ <b>{machine}</b>: Occupied ({remaining} min left)")
+            status_lines.append(f"⏳ <b>{machine.name}</b>: Occupied ({remaining_minutes(info, now)} min left)")
+        elif status == 'reserved':
+            status_lines.append(f"🔒 <b>{machine.name}</b>: Reserved for the next in line ({remaining_minutes(info, now)} min)")
         elif status == 'broken':
-            status_lines.append(f"❌ <b>{machine}</b>: Broken")
+            status_lines.append(f"❌ <b>{machine.name}</b>: Broken")
+
+    free_machines = tuple(free_machines)
+    if cache.get('free_machines') != free_machines:
+        keyboard = [
+            [InlineKeyboardButton(
+                f"▶️ Start {machine.name}", callback_data=callback_codec.encode(callback_codec.START_MACHINE, machine.token)
+            )]
+            for machine in free_machines
+        ]
+        keyboard.append([InlineKeyboardButton(
+            "🔧 Modify Status", callback_data=callback_codec.encode(callback_codec.MODIFY_STATUS)
+        )])
+        keyboard.append([InlineKeyboardButton(
+            "🔄 Refresh Status", callback_data=callback_codec.encode(callback_codec.REFRESH_STATUS)
+        )])
+        cache['free_machines'] = free_machines
+        cache['reply_markup'] = InlineKeyboardMarkup(keyboard)
 
     status_message = "⚙️ <b>Machine Statuses:</b>\n\n" + "\n".join(status_lines)
-    keyboard.append([InlineKeyboardButton("🔧 Modify Status", callback_data="modify_status")])
-    keyboard.append([InlineKeyboardButton("🔄 Refresh Status", callback_data="refresh_status")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Telegram reports message text without markup, so compare against this form
+    plain_message = status_message.replace("<b>", "").replace("</b>", "")
+    cache['key'] = key
+    cache['view'] = (status_message, plain_message, cache['reply_markup'])
+    return cache['view']
+
+async def show_machine_statuses(chat_id, context: ContextTypes.DEFAULT_TYPE, tenant, message=None):
+    """Display the current machine statuses and keep them updated live."""
+    view = render_machine_statuses(tenant)
+    status_message, plain_message, reply_markup = view
+    dashboards = tenant.dashboards
 
     if message:
-        try:
-            await message.edit_text(text=status_message, reply_markup=reply_markup, parse_mode="HTML")
-        except telegram.error.BadRequest as e:
-            if "Message is not modified" in str(e):
-                pass
-            else:
-                raise
+        dashboards.subscribe(message.chat_id, message.message_id, view)
+        # Skip the API call when the message already shows this view
+        if message.text == plain_message and message.reply_markup == reply_markup:
+            return
+        await context.bot_data['sender'].edit_message_text(
+            message.chat_id,
+            message.message_id,
+            text=status_message,
+            reply_markup=reply_markup,
+            parse_mode="HTML"
+        )
     else:
-        await context.bot.send_message(chat_id=chat_id, text=status_message, reply_markup=reply_markup, parse_mode="HTML")
+        message = await context.bot_data['sender'].send_message(
+            chat_id, text=status_message, reply_markup=reply_markup, parse_mode="HTML"
+        )
+        dashboards.subscribe(message.chat_id, message.message_id, view)
 
+@timed
 async def button_click_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle all button clicks."""
+    """Handle all button clicks by dispatching on the encoded action."""
     query = update.callback_query
     await query.answer()
     user = query.from_user
     username = user.username
-    callback_data = query.data
+    tenant = resolve_tenant(context, query.message.chat_id, user, "button click")
 
-    if username not in AUTHORIZED_USERS:
-        await query.edit_message_text("❌ <b>Access Denied.</b>", parse_mode="HTML")
-        logger.warning(f"Unauthorized button click by @{username}.")
+    if tenant is None:
+        await edit_query_message(context, None, query, "❌ <b>Access Denied.</b>", parse_mode="HTML")
         return
 
-    if callback_data in ['show_status', 'refresh_status']:
-        # Log refresh status action with "None" as string instead of None
-        if callback_data == 'refresh_status':
-            log_action(username, "Refresh Status", "None")
-        await show_machine_statuses(query.message.chat_id, context, query.message)
-        return
-    
-    if callback_data == 'modify_status':
-        await show_machine_selection(update, context)
+    action, machine_token, argument = callback_codec.decode(query.data)
+    handler = CALLBACK_HANDLERS.get(action)
+    if handler is None:
+        logger.warning("Unknown callback data %r from @%s.", query.data, username)
         return
 
-    if callback_data.startswith('start_'):
-        await handle_machine_start(query, context, user)
+    machine = tenant.registry.by_token.get(machine_token) if machine_token else None
+    if machine:
+        bind(machine=machine.id)
+    if machine is None and action in callback_codec.MACHINE_ACTIONS:
+        await edit_query_message(context, tenant, query, "⚠️ <b>Selected machine does not exist.</b>", parse_mode="HTML")
+        return
 
-async def handle_machine_start(query, context: ContextTypes.DEFAULT_TYPE, user):
+    await sync_machines(tenant)
+    try:
+        await handler(query, context, tenant, machine, argument)
+    except StateConflict as e:
+        # Another worker changed the machine mid-update; show what it did
+        logger.info("Update from @%s lost to a concurrent change: %s", username, e)
+        await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+
+@timed
+async def handle_show_status(query, context, tenant, machine, argument):
+    """Show the machine statuses in place of the pressed message."""
+    await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+
+@timed
+async def handle_refresh_status(query, context, tenant, machine, argument):
+    """Refresh the machine statuses."""
+    # Log refresh status action with "None" as string instead of None
+    record_action(tenant, query.from_user.id, query.from_user.username, "Refresh Status")
+    await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+
+@timed
+async def handle_machine_start(query, context: ContextTypes.DEFAULT_TYPE, tenant, machine, argument):
     """Handle starting a machine."""
-    machine_name = query.data.split('start_')[1]
-    machines = context.bot_data.setdefault('machines', {})
-    machine = machines.get(machine_name)
+    # Only one of several users racing for the same machine may start it;
+    # the lock covers the decision only, replies are sent after releasing it
+    async with machine_lock(tenant, machine.id):
+        info = tenant.machines[machine.id]
+        claimed = info['status'] == 'reserved' and info.get('user_id') == query.from_user.id
+        available = info['status'] == 'free' or claimed
+        if available:
+            started = await set_machine_occupied(
+                query, context, tenant, machine, machine.duration, query.from_user.username
+            )
 
-    if not machine:
-        await query.edit_message_text("⚠️ <b>Selected machine does not exist.</b>", parse_mode="HTML")
-        return
+    if not available:
+        await handle_unavailable_machine(query, context, tenant, machine, info)
+    elif started:
+        await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+    else:
+        await edit_query_message(context, tenant, query, "⚠️ An error occurred. Please try again.", parse_mode="HTML")
 
-    if machine['status'] != 'free':
-        await handle_unavailable_machine(query, machine_name, machine)
+async def handle_unavailable_machine(query, context, tenant, machine, info):
+    """Handle when a machine is unavailable, offering the waitlist for its type."""
+    status = info['status']
+    if status == 'occupied':
+        remaining = remaining_minutes(info)
+        message = f"⏳ <b>{machine.name}</b> is currently occupied for another <b>{remaining} minutes</b>."
+    else:
+        message = f" <b>{machine.name}</b> is currently <b>{status}</b>."
+
+    position = await tenant.shared.waitlist_position(tenant.id, machine.type, query.from_user.id)
+    if position is None:
+        ahead = await tenant.shared.waitlist_waiting(tenant.id, machine.type)
+        wait = predicted_wait(tenant, machine.type, ahead + 1)
+        if wait is not None:
+            message += f"\nThe next {machine.type} should be yours in about <b>{wait} minutes</b>."
+        button = InlineKeyboardButton(
+            f"🔔 Join the {machine.type} waitlist ({ahead} waiting)",
+            callback_data=callback_codec.encode(callback_codec.JOIN_WAITLIST, machine.token)
+        )
+    else:
+        message += f"\nYou are <b>#{position}</b> in the {machine.type} waitlist."
+        button = InlineKeyboardButton(
+            "🚪 Leave the waitlist", callback_data=callback_codec.encode(callback_codec.LEAVE_WAITLIST, machine.token)
+        )
+    keyboard = [
+        [button],
+        [InlineKeyboardButton("↩️ Back", callback_data=callback_codec.encode(callback_codec.SHOW_STATUS))]
+    ]
+    await edit_query_message(context, tenant, query, message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
+
+@timed
+async def handle_join_waitlist(query, context, tenant, machine, argument):
+    """Queue the user for the next free machine of the pressed machine's type."""
+    user = query.from_user
+    if any(
+        tenant.machines[other.id]['status'] == 'free' for other in tenant.registry if other.type == machine.type
+    ):
+        # Nothing to wait for; show the start buttons instead
+        await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
         return
 
-    duration = get_machine_duration(machine_name)
-    await set_machine_occupied(query, context, machine_name, duration, user.username)
-    
-    # Remove this logging since it's now in set_machine_occupied
-    # airtable_machine_name = MACHINE_MAP.get(machine_name, machine_name)
-    # log_action(user.username, "Start Cycle", airtable_machine_name, duration)
-
-def get_machine_duration(machine_name):
-    """Get the duration for a machine type."""
-    duration_map = {
-        'Washer': 25,  # Standard wash cycle
-        'Dryer': 60,    # Standard dry cycle
-    }
-    machine_type = next((key for key in duration_map if key.lower() in machine_name.lower()), 'Unknown')
-    return duration_map.get(machine_type, 2)
+    position = await tenant.shared.waitlist_join(tenant.id, machine.type, user.id, user.username)
+    wait = predicted_wait(tenant, machine.type, position)
+    estimate = f" Expected in about <b>{wait} minutes</b>." if wait is not None else ""
+    logger.info("@%s joined the %s waitlist at #%s.", user.username, machine.type, position)
 
-async def handle_unavailable_machine(query, machine_name, machine):
-    """Handle when a machine is unavailable."""
-    status = machine['status']
-    if status == 'occupied':
-        end_time = machine.get('end_time')
-        remaining = (end_time - datetime.datetime.now()).total_seconds() / 60 if end_time else 0
-        remaining = max(int(remaining), 0)
-        message = f"⏳ <b>{machine_name}</b> is currently occupied for another <b>{remaining} minutes</b>."
-    else:
-        message = f" <b>{machine_name}</b> is currently <b>{status}</b>."
-    await query.edit_message_text(message, parse_mode="HTML")
+    keyboard = [
+        [InlineKeyboardButton(
+            "🚪 Leave the waitlist", callback_data=callback_codec.encode(callback_codec.LEAVE_WAITLIST, machine.token)
+        )],
+        [InlineKeyboardButton("↩️ Back", callback_data=callback_codec.encode(callback_codec.SHOW_STATUS))]
+    ]
+    await edit_query_message(
+        context,
+        tenant,
+        query,
+        f"🔔 You are <b>#{position}</b> in the {machine.type} waitlist.{estimate}\n"
+        f"I will message you when a {machine.type} is reserved for you.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="HTML"
+    )
 
-async def set_machine_occupied(query, context, machine_name, duration, username):
-    """Set a machine as occupied."""
+@timed
+async def handle_leave_waitlist(query, context, tenant, machine, argument):
+    """Remove the user from the waitlist of the pressed machine's type."""
+    user = query.from_user
+    if await tenant.shared.waitlist_leave(tenant.id, machine.type, user.id):
+        logger.info("@%s left the %s waitlist.", user.username, machine.type)
+    await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+
+async def set_machine_occupied(query, context, tenant, machine, duration, username):
+    """Set a machine as occupied; returns False if that failed. Shows nothing, so it can run under the lock."""
     try:
         end_time = datetime.datetime.now() + datetime.timedelta(minutes=duration)
-        context.bot_data['machines'][machine_name] = {
+        info = {
             'status': 'occupied',
             'user_id': query.from_user.id,
             'username': username,
@@ -179,226 +690,232 @@ async def set_machine_occupied(query, context, machine_name, duration, username)
             'end_time': end_time,
             'duration': duration
         }
+        await update_machine(tenant, machine.id, info)
+        await tenant.shared.waitlist_leave(tenant.id, machine.type, query.from_user.id)
         
-        # Schedule the machine to be freed
-        context.job_queue.run_once(
-            free_machine,
-            when=duration * 60,
-            data={
-                'machine_name': machine_name,
-                'user_id': query.from_user.id,
-                'username': username
-            }
-        )
+        # Schedule the machine to be freed, replacing any claim expiry
+        schedule_expiry(context.application, tenant, machine.id, info)
         
-        airtable_machine_name = MACHINE_MAP.get(machine_name, machine_name)
-        log_action(username, "Start Cycle", airtable_machine_name, duration)
+        record_action(tenant, query.from_user.id, username, "Start Cycle", machine.label, duration)
         
-        logger.info(f"Started {machine_name} for @{username} for {duration} minutes.")
-
-        # Add this line to refresh the status display
-        await show_machine_statuses(query.message.chat_id, context, query.message)
+        logger.info("Started %s for @%s for %s minutes.", machine.name, username, duration)
+        return True
 
+    except StateConflict:
+        raise
     except Exception as e:
-        logger.error(f"Error setting machine occupied: {e}")
-        await query.edit_message_text("⚠️ An error occurred. Please try again.", parse_mode="HTML")
+        logger.error("Error setting machine occupied: %s", e)
+        return False
 
-async def free_machine(context: ContextTypes.DEFAULT_TYPE):
+@timed
+async def free_machine(application, tenant, job_data):
     """Free the machine and notify the user."""
-    job_data = context.job.data
-    machine_name = job_data['machine_name']
+    machine = tenant.registry.get(job_data['machine_id'])
+    bind(user_id=job_data['user_id'], machine=machine.id)
     user_id = job_data['user_id']
     username = job_data['username']
 
-    machines = context.bot_data.get('machines', {})
-    machine = machines.get(machine_name)
+    async with machine_lock(tenant, machine.id):
+        info = tenant.machines.get(machine.id)
+
+        # Ignore entries left over from a cycle that has since been overridden
+        if not info or info.get('cycle') != job_data['cycle']:
+            logger.info("Skipping stale free_machine for %s.", machine.name)
+            return
 
-    if machine and machine['status'] == 'occupied':
-        machines[machine_name] = {'status': 'free'}
-        logger.info(f"Machine {machine_name} is now free. Notified @{username}.")
+        if info['status'] != 'occupied':
+            return
+
+        claim = await release_machine(application, tenant, machine)
+        logger.info("Machine %s is now free. Notified @%s.", machine.name, username)
         
-        airtable_machine_name = MACHINE_MAP.get(machine_name, machine_name)
-        log_action(username, "Set Free", airtable_machine_name)
+        record_action(tenant, user_id, username, "Set Free", machine.label)
 
-        try:
-            notification = await context.bot.send_message(
-                chat_id=user_id,
-                text=f"🎉 <b>{machine_name}</b> is now free. Your cycle is complete.",
-                parse_mode="HTML"
-            )
+    if claim:
+        await notify_claim(application, tenant, machine, claim)
 
-            await asyncio.sleep(24 * 60 * 60)
-            await context.bot.delete_message(chat_id=user_id, message_id=notification.message_id)
-            logger.info(f"Deleted notification message for @{username} after 10 seconds.")
+    try:
+        notification = await application.bot_data['sender'].send_message(
+            user_id,
+            text=f"🎉 <b>{machine.name}</b> is now free. Your cycle is complete.",
+            parse_mode="HTML"
+        )
 
-        except Exception as e:
-            logger.error(f"Failed to send or delete notification for @{username}: {e}")
+        # Delete the notification later without keeping this coroutine alive
+        tenant.scheduler.schedule(
+            ('delete', user_id, notification.message_id),
+            NOTIFICATION_TTL,
+            delete_notification,
+            application,
+            user_id,
+            notification.message_id
+        )
+
+    except Exception as e:
+        logger.error("Failed to send notification for @%s: %s", username, e)
+
+@timed
+async def expire_claim(application, tenant, job_data):
+    """Pass a reserved machine on when its claimant did not start it in time."""
+    machine = tenant.registry.get(job_data['machine_id'])
+    bind(user_id=job_data['user_id'], machine=machine.id)
+
+    async with machine_lock(tenant, machine.id):
+        info = tenant.machines.get(machine.id)
+        if not info or info.get('cycle') != job_data['cycle'] or info['status'] != 'reserved':
+            return
+        claim = await release_machine(application, tenant, machine)
+        logger.info("Reservation of %s for @%s expired.", machine.name, job_data['username'])
+
+    if claim:
+        await notify_claim(application, tenant, machine, claim)
+
+@timed
+async def delete_notification(application, chat_id, message_id):
+    """Delete a cycle-complete notification."""
+    try:
+        await application.bot_data['sender'].delete_message(chat_id, message_id)
+        logger.info("Deleted notification message %s in chat %s.", message_id, chat_id)
+    except Exception as e:
+        logger.error("Failed to delete notification %s in chat %s: %s", message_id, chat_id, e)
 
 # Status modification handlers
-async def show_machine_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@timed
+async def show_machine_selection(query, context: ContextTypes.DEFAULT_TYPE, tenant, machine=None, argument=None):
     """Show machine selection buttons for status modification."""
-    query = update.callback_query
-    machines = context.bot_data.get('machines', {})
     keyboard = []
     
-    for machine in machines.keys():
-        keyboard.append([InlineKeyboardButton(machine, callback_data=f"select_machine_{machine}")])
-    keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel_modification")])
+    for machine in tenant.registry:
+        keyboard.append([InlineKeyboardButton(
+            machine.name, callback_data=callback_codec.encode(callback_codec.SELECT_MACHINE, machine.token)
+        )])
+    keyboard.append([InlineKeyboardButton(
+        "❌ Cancel", callback_data=callback_codec.encode(callback_codec.CANCEL_MODIFICATION)
+    )])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("Select a machine to modify its status:", reply_markup=reply_markup)
-    return SELECTING_MACHINE
+    await edit_query_message(context, tenant, query, "Select a machine to modify its status:", reply_markup=reply_markup)
+
+def time_button(machine, minutes):
+    return InlineKeyboardButton(
+        f"⏳ {minutes} min", callback_data=callback_codec.encode(callback_codec.SET_TIME, machine.token, minutes)
+    )
 
-async def show_status_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@timed
+async def show_status_options(query, context: ContextTypes.DEFAULT_TYPE, tenant, machine, argument=None):
     """Show status options for the selected machine."""
-    query = update.callback_query
-    await query.answer()
-    
-    machine_name = query.data.replace("select_machine_", "")
-    context.user_data['selected_machine'] = machine_name
-    
     # Get current machine status
-    machine_info = context.bot_data.get('machines', {}).get(machine_name, {})
+    machine_info = tenant.machines.get(machine.id, {})
     current_status = machine_info.get('status', 'unknown')
     
-    # Create status buttons
+    # Create status buttons; each one carries the machine, so no conversation state is needed
     keyboard = [
-        [InlineKeyboardButton("✅ Set as Free", callback_data="set_status_free")],
-        [InlineKeyboardButton("❌ Set as Broken", callback_data="set_status_broken")],
+        [InlineKeyboardButton("✅ Set as Free", callback_data=callback_codec.encode(callback_codec.SET_FREE, machine.token))],
+        [InlineKeyboardButton("❌ Set as Broken", callback_data=callback_codec.encode(callback_codec.SET_BROKEN, machine.token))],
         # Time buttons in descending order, 2 per row
+        [time_button(machine, 60), time_button(machine, 50)],
+        [time_button(machine, 45), time_button(machine, 40)],
+        [time_button(machine, 35), time_button(machine, 30)],
+        [time_button(machine, 25), time_button(machine, 20)],
+        [time_button(machine, 15), time_button(machine, 10)],
         [
-            InlineKeyboardButton("⏳ 60 min", callback_data="set_time_60"),
-            InlineKeyboardButton("⏳ 50 min", callback_data="set_time_50")
-        ],
-        [
-            InlineKeyboardButton("⏳ 45 min", callback_data="set_time_45"),
-            InlineKeyboardButton("⏳ 40 min", callback_data="set_time_40")
-        ],
-        [
-            InlineKeyboardButton("⏳ 35 min", callback_data="set_time_35"),
-            InlineKeyboardButton("⏳ 30 min", callback_data="set_time_30")
-        ],
-        [
-            InlineKeyboardButton("⏳ 25 min", callback_data="set_time_25"),
-            InlineKeyboardButton("⏳ 20 min", callback_data="set_time_20")
-        ],
-        [
-            InlineKeyboardButton("⏳ 15 min", callback_data="set_time_15"),
-            InlineKeyboardButton("⏳ 10 min", callback_data="set_time_10")
-        ],
-        [
-            InlineKeyboardButton("⏳ 5 min", callback_data="set_time_5"),
-            InlineKeyboardButton("↩️ Back", callback_data="modify_status")
+            time_button(machine, 5),
+            InlineKeyboardButton("↩️ Back", callback_data=callback_codec.encode(callback_codec.MODIFY_STATUS))
         ],
     ]
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     message = (
-        f"Machine: <b>{machine_name}</b>\n"
+        f"Machine: <b>{machine.name}</b>\n"
         f"Current Status: <b>{current_status.upper()}</b>\n\n"
         f"Choose new status:"
     )
     
-    await query.edit_message_text(
+    await edit_query_message(
+        context,
+        tenant,
+        query,
         message,
         reply_markup=reply_markup,
         parse_mode="HTML"
     )
-    return SELECTING_STATUS
 
-async def handle_status_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_status_selection(query, context: ContextTypes.DEFAULT_TYPE, tenant, machine, argument, action):
     """Handle the status selection for a machine."""
-    query = update.callback_query
-    await query.answer()
-    
-    machine_name = context.user_data.get('selected_machine')
-    username = query.from_user.username
-    action = query.data
-    airtable_machine_name = MACHINE_MAP.get(machine_name)
-    
-    if action == "set_status_free":
-        context.bot_data['machines'][machine_name] = {'status': 'free'}
-        log_action(username, "Set Free", airtable_machine_name)
-        await show_machine_statuses(query.message.chat_id, context, query.message)
-        return ConversationHandler.END
-    
-    elif action == "set_status_broken":
-        context.bot_data['machines'][machine_name] = {'status': 'broken'}
-        log_action(username, "Set Broken", airtable_machine_name)
-        await show_machine_statuses(query.message.chat_id, context, query.message)
-        return ConversationHandler.END
-    
-    elif action.startswith("set_time_"):
+    duration = None
+    if action == callback_codec.SET_TIME:
         try:
-            duration = int(action.split("_")[-1])
-            end_time = datetime.datetime.now() + datetime.timedelta(minutes=duration)
-            
-            context.bot_data['machines'][machine_name] = {
-                'status': 'occupied',
-                'end_time': end_time,
-                'user_id': query.from_user.id,
-                'username': username,
-                'duration': duration,
-                'start_time': datetime.datetime.now()
-            }
-            
-            log_action(username, "Set Cycle", airtable_machine_name, duration)
-            
-            # Schedule the machine to be freed (convert minutes to seconds)
-            context.job_queue.run_once(
-                free_machine,
-                when=duration * 60,  # Convert minutes to seconds
-                data={
-                    'machine_name': machine_name,
-                    'user_id': query.from_user.id,
-                    'username': username
-                }
-            )
-            
-            await query.edit_message_text(
-                f"✅ Set <b>{machine_name}</b> as occupied for {duration} minutes.",
-                parse_mode="HTML"
-            )
-            
-            # Add this line to refresh the status display
-            await show_machine_statuses(query.message.chat_id, context, query.message)
-            return ConversationHandler.END
-            
-        except ValueError as e:
-            logger.error(f"Error processing time selection: {e}")
-            await query.edit_message_text(
+            duration = int(argument)
+        except (TypeError, ValueError) as e:
+            logger.error("Error processing time selection: %s", e)
+            await edit_query_message(
+                context,
+                tenant,
+                query,
                 "⚠️ An error occurred while setting the time.",
                 parse_mode="HTML"
             )
-            return ConversationHandler.END
+            return
 
-async def cancel_modification(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Cancel the status modification process."""
-    query = update.callback_query
-    await query.answer()
-    await show_machine_statuses(query.message.chat_id, context, query.message)
-    return ConversationHandler.END
-
-def get_status_modification_handler():
-    """Create and return the ConversationHandler for status modification."""
-    return ConversationHandler(
-        entry_points=[
-            CallbackQueryHandler(show_machine_selection, pattern="^modify_status$")
-        ],
-        states={
-            SELECTING_MACHINE: [
-                CallbackQueryHandler(show_status_options, pattern="^select_machine_"),
-                CallbackQueryHandler(cancel_modification, pattern="^cancel_modification$")
-            ],
-            SELECTING_STATUS: [
-                CallbackQueryHandler(handle_status_selection, pattern="^set_status_"),
-                CallbackQueryHandler(handle_status_selection, pattern="^set_time_"),
-                CallbackQueryHandler(show_machine_selection, pattern="^modify_status$")
-            ]
-        },
-        fallbacks=[
-            CallbackQueryHandler(cancel_modification, pattern="^cancel_modification$")
-        ],
-        allow_reentry=True
-    )
+    # Hold the lock for the state change only; render and notify after releasing it
+    async with machine_lock(tenant, machine.id):
+        claim = await apply_status_selection(query, context, tenant, machine, action, duration)
+
+    await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+    if claim:
+        await notify_claim(context.application, tenant, machine, claim)
+
+async def apply_status_selection(query, context, tenant, machine, action, duration):
+    """Apply an admin status change while holding the machine's lock; returns the waitlist claim made, if any."""
+    username = query.from_user.username
+
+    if action == callback_codec.SET_FREE:
+        cancel_expiry(tenant, machine.id)
+        claim = await release_machine(context.application, tenant, machine)
+        record_action(tenant, query.from_user.id, username, "Set Free", machine.label)
+        return claim
+    
+    elif action == callback_codec.SET_BROKEN:
+        cancel_expiry(tenant, machine.id)
+        await update_machine(tenant, machine.id, {'status': 'broken'})
+        record_action(tenant, query.from_user.id, username, "Set Broken", machine.label)
     
+    elif action == callback_codec.SET_TIME:
+        end_time = datetime.datetime.now() + datetime.timedelta(minutes=duration)
+        
+        info = {
+            'status': 'occupied',
+            'end_time': end_time,
+            'user_id': query.from_user.id,
+            'username': username,
+            'duration': duration,
+            'start_time': datetime.datetime.now()
+        }
+        await update_machine(tenant, machine.id, info)
+        
+        record_action(tenant, query.from_user.id, username, "Set Cycle", machine.label, duration)
+        
+        # Reschedule the machine to be freed, replacing any earlier entry
+        schedule_expiry(context.application, tenant, machine.id, info)
+        logger.info("Set %s as occupied for %s minutes.", machine.name, duration)
+    return None
+
+@timed
+async def cancel_modification(query, context: ContextTypes.DEFAULT_TYPE, tenant, machine=None, argument=None):
+    """Cancel the status modification process."""
+    await show_machine_statuses(query.message.chat_id, context, tenant, query.message)
+
+# Callback action -> handler(query, context, tenant, machine, argument)
+CALLBACK_HANDLERS = {
+    callback_codec.SHOW_STATUS: handle_show_status,
+    callback_codec.REFRESH_STATUS: handle_refresh_status,
+    callback_codec.START_MACHINE: handle_machine_start,
+    callback_codec.MODIFY_STATUS: show_machine_selection,
+    callback_codec.SELECT_MACHINE: show_status_options,
+    callback_codec.SET_FREE: timed(functools.partial(handle_status_selection, action=callback_codec.SET_FREE), name='handle_set_free'),
+    callback_codec.SET_BROKEN: timed(functools.partial(handle_status_selection, action=callback_codec.SET_BROKEN), name='handle_set_broken'),
+    callback_codec.SET_TIME: timed(functools.partial(handle_status_selection, action=callback_codec.SET_TIME), name='handle_set_time'),
+    callback_codec.CANCEL_MODIFICATION: cancel_modification,
+    callback_codec.JOIN_WAITLIST: handle_join_waitlist,
+    callback_codec.LEAVE_WAITLIST: handle_leave_waitlist,
+}
@@ -0,0 +1,99 @@
+import os
+import heapq
+import itertools
+from dataclasses import dataclass
+
+CLAIM_TIMEOUT = int(os.getenv('CLAIM_TIMEOUT', '300'))  # Seconds a user has to start a machine handed to them
+
+@dataclass(frozen=True)
+class WaitlistEntry:
+    user_id: int
+    username: str
+    priority: int
+    seq: int
+
+class Waitlist:
+    """
+    Per machine type queues of users waiting for the next free machine.
+
+    Each type has a min-heap ordered by (priority, join order). Leaving is a
+    dict removal; stale heap entries are skipped when they reach the top,
+    the same lazy deletion the expiry scheduler uses.
+    """
+
+    def __init__(self):
+        self.heaps = {}  # machine type -> [(priority, seq, user_id)]
+        self.entries = {}  # machine type -> {user_id: WaitlistEntry}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+
+    def waiting(self, machine_type):
+        """Return the number of users waiting for a machine type."""
+        return len(self.entries.get(machine_type, ()))
+
+    def join(self, machine_type, user_id, username, priority=0):
+        """Queue a user for a machine type and return their position; joining twice keeps the first place."""
+        entries = self.entries.setdefault(machine_type, {})
+        if user_id not in entries:
+            entry = WaitlistEntry(user_id, username, priority, next(self.counter))
+            entries[user_id] = entry
+            heapq.heappush(self.heaps.setdefault(machine_type, []), (entry.priority, entry.seq, user_id))
+        return self.position(machine_type, user_id)
+
+    def requeue(self, machine_type, entry):
+        """Put back a popped entry in its original place, e.g. when handing it a machine failed."""
+        entries = self.entries.setdefault(machine_type, {})
+        if entry.user_id not in entries:
+            entries[entry.user_id] = entry
+            heapq.heappush(self.heaps.setdefault(machine_type, []), (entry.priority, entry.seq, entry.user_id))
+
+    def leave(self, machine_type, user_id):
+        """Remove a user from a queue. Returns True if they were waiting."""
+        entries = self.entries.get(machine_type, {})
+        if entries.pop(user_id, None) is None:
+            return False
+        heap = self.heaps[machine_type]
+        if len(heap) > 2 * len(entries) + 16:
+            self.heaps[machine_type] = [(entry.priority, entry.seq, entry.user_id) for entry in entries.values()]
+            heapq.heapify(self.heaps[machine_type])
+        return True
+
+    def position(self, machine_type, user_id):
+        """Return a user's 1-based place in the queue, or None."""
+        entries = self.entries.get(machine_type, {})
+        entry = entries.get(user_id)
+        if entry is None:
+            return None
+        key = (entry.priority, entry.seq)
+        return 1 + sum(1 for other in entries.values() if (other.priority, other.seq) < key)
+
+    def pop(self, machine_type):
+        """Remove and return the next user waiting for a machine type, or None."""
+        heap = self.heaps.get(machine_type)
+        entries = self.entries.get(machine_type, {})
+        while heap:
+            _, seq, user_id = heapq.heappop(heap)
+            entry = entries.get(user_id)
+            if entry is not None and entry.seq == seq:
+                del entries[user_id]
+                return entry
+        return None
+
+def predict_free_times(end_times, duration, count):
+    """
+    Predict when the next `count` machines of one type become available.
+
+    `end_times` holds when each working machine of the type frees up (now
+    for free machines). Each machine handed to a waiting user is assumed to
+    run one more cycle of `duration` (a timedelta) once it is claimed.
+    """
+    heap = list(end_times)
+    heapq.heapify(heap)
+    predicted = []
+    while heap and len(predicted) < count:
+        end_time = heapq.heappop(heap)
+        predicted.append(end_time)
+        heapq.heappush(heap, end_time + duration)
+    return predicted
@@ -0,0 +1,166 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import tornado.web
+import tornado.httpserver
+from telegram import Update
+from metrics import REGISTRY
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public base URL, e.g. https://washbot.herokuapp.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '256'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Private port for /metrics and /debug/profile; off when 0
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+QUEUE_FULL_RETRY_AFTER = 1  # Seconds Telegram should wait before redelivering
+
+logger = logging.getLogger(__name__)
+
+class UpdateHandler(tornado.web.RequestHandler):
+    """Receive updates from Telegram and put them on the Application's update queue."""
+
+    def initialize(self, bot_application, secret_token):
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    async def post(self):
+        received = self.request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received, self.secret_token):
+            logger.warning("Rejected webhook request with an invalid secret token.")
+            self.set_status(403)
+            return
+
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except (ValueError, TypeError) as e:
+            logger.warning("Rejected malformed webhook payload: %s", e)
+            self.set_status(400)
+            return
+
+        # Refuse instead of buffering without bound; Telegram redelivers later
+        try:
+            self.bot_application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Update queue is full, asking Telegram to retry.")
+            self.set_status(503)
+            self.set_header('Retry-After', str(QUEUE_FULL_RETRY_AFTER))
+            return
+
+        self.set_status(200)
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Report liveness, update queue depth and outbound sender metrics."""
+
+    def initialize(self, bot_application):
+        self.bot_application = bot_application
+
+    def get(self):
+        health = {
+            'status': 'ok' if self.bot_application.running else 'stopped',
+            'update_queue': self.bot_application.update_queue.qsize(),
+            'update_queue_size': self.bot_application.update_queue.maxsize,
+        }
+        sender = self.bot_application.bot_data.get('sender')
+        if sender:
+            health['outbound'] = sender.metrics()
+        self.write(health)
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serve metrics in the Prometheus text format."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(REGISTRY.render())
+
+class ProfileHandler(tornado.web.RequestHandler):
+    """Serve the sampling profiler's collapsed stacks, for flame graphs."""
+
+    def initialize(self, bot_application):
+        self.bot_application = bot_application
+
+    def get(self):
+        profiler = self.bot_application.bot_data.get('profiler')
+        if profiler is None or not profiler.samples:
+            self.set_status(404)
+            self.write("No profile recorded; start one with /profile.\n")
+            return
+        self.set_header('Content-Type', 'text/plain; charset=utf-8')
+        self.write(profiler.collapsed())
+
+def monitoring_routes(application):
+    """Routes for the private monitoring port; metrics and profiles are not for the public."""
+    return [
+        (r'/healthz', HealthHandler, {'bot_application': application}),
+        (r'/metrics', MetricsHandler),
+        (r'/debug/profile', ProfileHandler, {'bot_application': application}),
+    ]
+
+def make_web_app(application, secret_token=WEBHOOK_SECRET):
+    """Build the tornado app for the public port: the webhook and the health check only."""
+    if not secret_token:
+        raise RuntimeError("WEBHOOK_SECRET must be set to run in webhook mode.")
+    return tornado.web.Application([
+        (WEBHOOK_PATH, UpdateHandler, {'bot_application': application, 'secret_token': secret_token}),
+        (r'/healthz', HealthHandler, {'bot_application': application}),
+    ])
+
+def start_monitoring_server(application, port=METRICS_PORT):
+    """Serve the monitoring endpoints on their own port. Returns the server, or None if disabled."""
+    if not port:
+        return None
+    server = tornado.httpserver.HTTPServer(tornado.web.Application(monitoring_routes(application)))
+    server.listen(port)
+    logger.info("Monitoring endpoints listening on port %s.", port)
+    return server
+
+async def serve_webhook(application, port=WEBHOOK_PORT, secret_token=WEBHOOK_SECRET, register=True, stop_event=None):
+    """
+    Run the Application behind the embedded webhook server until SIGINT/SIGTERM,
+    or until `stop_event` is set.
+
+    Refuses to start without a secret token, since anyone who finds the URL
+    could otherwise post updates. With register=False the webhook is not set
+    with Telegram, e.g. to serve fake updates offline.
+    """
+    if not secret_token:
+        raise RuntimeError("WEBHOOK_SECRET must be set to run in webhook mode.")
+    if register and not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set to run in webhook mode.")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    server = tornado.httpserver.HTTPServer(make_web_app(application, secret_token))
+    server.listen(port)
+    if register:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    await application.start()
+    logger.info("Webhook server listening on port %s.", port)
+
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        await stop_event.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)